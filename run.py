@@ -12,12 +12,13 @@ src_dir = os.path.join(current_dir, "src")
 sys.path.insert(0, src_dir)
 
 # 导入主模块
-from src.main import main
+from src.main import main, setup_event_loop_policy
 import asyncio
 
 if __name__ == "__main__":
     # 启动主程序
     try:
+        setup_event_loop_policy()
         asyncio.run(main())
     except KeyboardInterrupt:
         print("程序被用户中断")
@@ -3,25 +3,46 @@ Agent基类模块
 定义所有专家Agent的共同接口和基础功能
 """
 
-from typing import List, Dict, Any, Optional
-import concurrent.futures
+from typing import List, Dict, Any, Optional, AsyncIterator
+import asyncio
+import os
 from loguru import logger
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-# 创建线程池执行器，用于异步处理LLM调用
-llm_executor = concurrent.futures.ThreadPoolExecutor(max_workers=10)
+# 限制同时进行的LLM请求数量，所有Agent共享；信号量在事件循环中首次使用时创建
+_LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+_llm_sem: Optional[asyncio.Semaphore] = None
+_llm_sem_loop = None
+
+
+def llm_semaphore() -> asyncio.Semaphore:
+    """
+    获取当前事件循环的LLM并发信号量
+    
+    Python 3.8/3.9中信号量在创建时绑定事件循环，不能在导入时创建；
+    generate_sync每次都会新建事件循环，事件循环变化时重新创建
+    
+    Returns:
+        asyncio.Semaphore: LLM并发信号量
+    """
+    global _llm_sem, _llm_sem_loop
+    loop = asyncio.get_running_loop()
+    if _llm_sem is None or _llm_sem_loop is not loop:
+        _llm_sem = asyncio.Semaphore(_LLM_MAX_CONCURRENCY)
+        _llm_sem_loop = loop
+    return _llm_sem
 
 
 class BaseAgent:
     """Agent基类，定义通用方法和接口"""
 
-    def __init__(self, client: OpenAI, system_prompt: str, safety_filter):
+    def __init__(self, client: AsyncOpenAI, system_prompt: str, safety_filter):
         """
         初始化Agent
         
         Args:
-            client: OpenAI API客户端
+            client: OpenAI API异步客户端
             system_prompt: 系统提示词
             safety_filter: 安全过滤函数
         """
@@ -29,7 +50,7 @@ class BaseAgent:
         self.system_prompt = system_prompt
         self.safety_filter = safety_filter
 
-    def generate(self, user_msg: str, item_desc: str, context: str, bargain_count: int = 0) -> str:
+    async def generate(self, user_msg: str, item_desc: str, context: str, bargain_count: int = 0) -> str:
         """
         生成回复的模板方法
         
@@ -41,15 +62,30 @@ class BaseAgent:
             
         Returns:
             str: 生成的回复内容
+            
+        Raises:
+            Exception: 大模型调用失败时抛出，由调用方决定兜底文案
         """
         messages = self._build_messages(user_msg, item_desc, context)
-        response = self._call_llm(messages)
+        response = await self._call_llm(messages)
         return self.safety_filter(response)
 
+    def generate_sync(self, *args, **kwargs) -> str:
+        """
+        同步版本的generate，供不在事件循环中的旧调用方使用
+        
+        Returns:
+            str: 生成的回复内容
+        """
+        return asyncio.run(self.generate(*args, **kwargs))
+
     def _build_messages(self, user_msg: str, item_desc: str, context: str) -> List[Dict[str, str]]:
         """
         构建消息链
         
+        固定不变的系统提示词放在最前面，商品信息和对话历史放在后面，
+        使同一提示词的请求共享前缀，便于服务端复用提示词缓存
+        
         Args:
             user_msg: 用户消息
             item_desc: 商品描述
@@ -59,11 +95,11 @@ class BaseAgent:
             List[Dict[str, str]]: 消息链列表
         """
         return [
-            {"role": "system", "content": f"【商品信息】{item_desc}\n【你与客户对话历史】{context}\n{self.system_prompt}"},
+            {"role": "system", "content": f"{self.system_prompt}\n【商品信息】{item_desc}\n【你与客户对话历史】{context}"},
             {"role": "user", "content": user_msg}
         ]
 
-    def _call_llm(self, messages: List[Dict], temperature: float = 0.4) -> str:
+    async def _call_llm(self, messages: List[Dict], temperature: float = 0.4) -> str:
         """
         调用大模型生成回复
         
@@ -74,21 +110,61 @@ class BaseAgent:
         Returns:
             str: 生成的文本
         """
-        # 定义实际执行的函数
-        def _execute_llm_call():
-            try:
-                response = self.client.chat.completions.create(
-                    model="qwen-max",  # 默认使用通义千问模型，可在子类中覆盖
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=500,
-                    top_p=0.8
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                logger.error(f"LLM调用失败: {e}")
-                return "抱歉，系统繁忙，请稍后再试。"
-                
-        # 使用线程池提交任务并等待结果
-        future = llm_executor.submit(_execute_llm_call)
-        return future.result()  # 等待任务完成并获取结果 
\ No newline at end of file
+        try:
+            # 默认使用通义千问模型，可在子类中覆盖
+            return await self._raw_llm(messages, model="qwen-max", temperature=temperature, max_tokens=500, top_p=0.8)
+        except Exception as e:
+            # 不返回兜底文案，避免出错时的文案被当作模型回复缓存
+            logger.error(f"LLM调用失败: {e}")
+            raise
+
+    async def _raw_llm(self, messages: List[Dict], *, model: str, temperature: float, max_tokens: int, top_p: float) -> str:
+        """
+        发起一次大模型请求，所有Agent共用，异常由调用方处理
+        
+        Args:
+            messages: 消息链
+            model: 模型名称
+            temperature: 温度参数
+            max_tokens: 最大生成token数
+            top_p: 核采样参数
+            
+        Returns:
+            str: 生成的文本
+        """
+        async with llm_semaphore():
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p
+            )
+        return response.choices[0].message.content
+
+    async def _stream_llm(self, messages: List[Dict], *, model: str, temperature: float, max_tokens: int, top_p: float) -> AsyncIterator[str]:
+        """
+        以流式方式发起大模型请求，逐段返回生成的文本，异常由调用方处理
+        
+        Args:
+            messages: 消息链
+            model: 模型名称
+            temperature: 温度参数
+            max_tokens: 最大生成token数
+            top_p: 核采样参数
+            
+        Yields:
+            str: 新生成的文本片段
+        """
+        async with llm_semaphore():
+            stream = await self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+                stream=True
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
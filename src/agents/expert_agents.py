@@ -3,18 +3,184 @@
 实现各种专业领域的Agent，如价格专家、技术专家等
 """
 
-from typing import Dict, List, Any, Optional
+from typing import AsyncIterator, Dict, List, Any, Optional, Tuple
+import asyncio
+import functools
+from collections import OrderedDict
+import mmap
 import re
+import sqlite3
+import time
+from hashlib import blake2b
 from loguru import logger
 import os
 
-from .base import BaseAgent
+from openai import AsyncOpenAI
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+    logger.warning("缺少 'tiktoken' 库，将按字符数截断对话上下文。请尝试运行 'pip install tiktoken' 安装。")
+
+from .base import BaseAgent, llm_semaphore
+from core.response_cache import ResponseCache, SemanticCache, SEMANTIC_CACHE_AVAILABLE, open_cache_db
+
+# 从上下文中提取用户ID的正则，按优先级排列
+_USER_ID_PATTERNS = [
+    re.compile(r'user: (\d+)'),
+    re.compile(r'user[:\s]+(\w+)'),
+    re.compile(r'用户[:\s]+(\w+)'),
+    re.compile(r'买家[:\s]+(\w+)'),
+    re.compile(r'send_user_id[:\s]+(\w+)'),
+]
+
+
+def _keyword_pattern(keywords: List[str]) -> "re.Pattern":
+    """将关键词列表编译为单个正则，一次扫描即可判断是否包含任一关键词"""
+    return re.compile("|".join(map(re.escape, keywords)))
+
+
+# 安全过滤的屏蔽词
+_BLOCKED_PHRASES = ["微信", "QQ", "支付宝", "银行卡", "线下"]
+_BLOCKED_RE = _keyword_pattern(_BLOCKED_PHRASES)
+# 流式输出时需要暂缓发送的字符数，保证屏蔽词不会被拆开发送出去
+_BLOCKED_HOLDBACK = max(map(len, _BLOCKED_PHRASES)) - 1
+
+# 系统通知类消息的关键词
+_SYSTEM_NOTICES = (
+    "你已发货", "发来一条新消息", "已付款", "准备发货", "已下单", 
+    "已经付款", "买家留言", "快递信息", "物流更新", "发货提醒", 
+    "系统通知", "已收货", "已评价", "已退款", "订单更新"
+)
+_NOTICE_RE = _keyword_pattern(_SYSTEM_NOTICES)
+
+# 价格相关的关键词，用于判断是否处于议价
+_PRICE_RE = _keyword_pattern(["价格", "优惠", "便宜", "贵", "元", "折扣", "价钱", "多少钱"])
+
+# 提示词文件路径，依次尝试当前工作目录和项目根目录
+_PROMPT_PATHS = (
+    os.path.join("prompts", "unified_prompt.txt"),
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'prompts', 'unified_prompt.txt')),
+)
+_FALLBACK_PROMPT = "你是闲鱼平台上卖家的智能助手，请帮助卖家回复买家的询问，保持礼貌和专业。"
+
+
+# 发送给模型的对话上下文和商品描述的最大token数
+_MAX_CONTEXT_TOKENS = int(os.getenv("LLM_MAX_CONTEXT_TOKENS", "1500"))
+_MAX_ITEM_DESC_TOKENS = 400
+
+
+def _truncate_tokens(text: str, max_tokens: int, keep_tail: bool = True) -> str:
+    """
+    将文本截断到指定token数，未安装tiktoken时按字符数截断
+    
+    Args:
+        text: 原始文本
+        max_tokens: 最大token数
+        keep_tail: 为True时保留末尾（最近的对话），否则保留开头
+        
+    Returns:
+        str: 截断后的文本
+    """
+    if _encoding is None:
+        if len(text) <= max_tokens:
+            return text
+        truncated = text[-max_tokens:] if keep_tail else text[:max_tokens]
+    else:
+        # 每个token至少对应一个字节（一个中文字符通常对应1~3个token），UTF-8字节数不超过上限时无需分词
+        if len(text.encode("utf-8")) <= max_tokens:
+            return text
+        ids = _encoding.encode(text)
+        if len(ids) <= max_tokens:
+            return text
+        # 截断处可能落在一个字符的多个token之间，按字节解码并丢弃不完整的字符，避免出现\ufffd
+        kept = ids[-max_tokens:] if keep_tail else ids[:max_tokens]
+        truncated = _encoding.decode_bytes(kept).decode("utf-8", errors="ignore")
+    
+    logger.debug("文本超过{}个token，已截断", max_tokens)
+    return truncated
+
+
+@functools.lru_cache(maxsize=2048)
+def _truncate_item_desc(item_desc: str) -> str:
+    """截断商品描述，同一商品的描述很少变化，结果直接缓存"""
+    return _truncate_tokens(item_desc, _MAX_ITEM_DESC_TOKENS, keep_tail=False)
+
+
+def safety_filter(text: str) -> str:
+    """简单的安全过滤函数，可以根据需要扩展"""
+    return "[安全提醒]请通过平台沟通" if _BLOCKED_RE.search(text) else text
+
+
+@functools.lru_cache(maxsize=1)
+def _cache_db() -> Optional[sqlite3.Connection]:
+    """进程内共享的回复缓存数据库连接，RESPONSE_CACHE_DB为空时只使用内存缓存"""
+    db_path = os.getenv("RESPONSE_CACHE_DB", "data/response_cache.db")
+    return open_cache_db(db_path) if db_path else None
+
+
+@functools.lru_cache(maxsize=1)
+def _shared_client() -> AsyncOpenAI:
+    """进程内共享的OpenAI客户端，所有机器人实例复用同一个连接池"""
+    return AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        base_url=os.getenv("OPENAI_BASE_URL")
+    )
+
+
+# 已加载的提示词缓存，格式: {文件路径: (修改时间, 内容)}
+_prompt_cache: Dict[str, Tuple[float, str]] = {}
+
+
+def _load_prompt(path: str) -> str:
+    """通过mmap一次性读取提示词文件并按UTF-8解码"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm[:].decode("utf-8")
+
+
+def _unified_prompt() -> str:
+    """
+    加载统一提示词
+    
+    文件修改时间未变化时直接返回缓存内容，修改提示词文件后无需重启即可生效
+    
+    Returns:
+        str: 提示词内容，找不到文件时返回后备提示词
+    """
+    for prompt_path in _PROMPT_PATHS:
+        try:
+            mtime = os.stat(prompt_path).st_mtime
+        except FileNotFoundError:
+            continue
+        
+        cached = _prompt_cache.get(prompt_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        
+        try:
+            unified_prompt = _load_prompt(prompt_path)
+        except Exception as e:
+            logger.error(f"加载统一提示词时出错: {e}")
+            continue
+        _prompt_cache[prompt_path] = (mtime, unified_prompt)
+        logger.info(f"已加载统一提示词，长度: {len(unified_prompt)} 字符")
+        return unified_prompt
+    
+    if not _prompt_cache:
+        logger.error(f"未找到统一提示词文件，使用后备提示词: {_PROMPT_PATHS}")
+        _prompt_cache[""] = (0.0, _FALLBACK_PROMPT)
+    return _FALLBACK_PROMPT
 
 
 class PriceAgent(BaseAgent):
     """议价处理Agent"""
 
-    def generate(self, user_msg: str, item_desc: str, context: str, bargain_count: int=0) -> str:
+    async def generate(self, user_msg: str, item_desc: str, context: str, bargain_count: int=0) -> str:
         """
         生成议价回复
         
@@ -37,25 +203,12 @@ class PriceAgent(BaseAgent):
         # 获取环境变量中的模型设置
         model = os.getenv("LLM_MODEL", "gpt-4-turbo")
         
-        # 调用LLM生成回复
-        def _execute_llm_call():
-            try:
-                response = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=dynamic_temp,  # 动态温度
-                    max_tokens=500,
-                    top_p=0.8
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                logger.error(f"议价Agent调用失败: {e}")
-                return "抱歉，系统繁忙，请稍后再试。"
-                
-        # 使用线程池执行
-        from .base import llm_executor
-        future = llm_executor.submit(_execute_llm_call)
-        result = future.result()
+        # 调用LLM生成回复，使用动态温度
+        try:
+            result = await self._raw_llm(messages, model=model, temperature=dynamic_temp, max_tokens=500, top_p=0.8)
+        except Exception as e:
+            logger.error(f"议价Agent调用失败: {e}")
+            raise
         
         return self.safety_filter(result)
         
@@ -78,7 +231,7 @@ class PriceAgent(BaseAgent):
 class TechAgent(BaseAgent):
     """技术专家Agent"""
     
-    def generate(self, user_msg: str, item_desc: str, context: str, bargain_count: int=0) -> str:
+    async def generate(self, user_msg: str, item_desc: str, context: str, bargain_count: int=0) -> str:
         """
         生成技术回复
         
@@ -98,25 +251,12 @@ class TechAgent(BaseAgent):
         model = os.getenv("LLM_MODEL", "gpt-4-turbo")
         temp = float(os.getenv("LLM_TEMPERATURE", "0.7")) * 0.3  # 技术回复使用较低温度
         
-        # 技术回复使用较低的温度，确保一致性和准确性
-        def _execute_llm_call():
-            try:
-                response = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=temp,  # 低温度，更确定性的回答
-                    max_tokens=800,  # 技术回复可能需要更长的内容
-                    top_p=0.8
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                logger.error(f"技术Agent调用失败: {e}")
-                return "抱歉，系统繁忙，请稍后再试。"
-                
-        # 使用线程池执行
-        from .base import llm_executor
-        future = llm_executor.submit(_execute_llm_call)
-        result = future.result()
+        # 技术回复使用较低的温度，确保一致性和准确性；技术回复可能需要更长的内容
+        try:
+            result = await self._raw_llm(messages, model=model, temperature=temp, max_tokens=800, top_p=0.8)
+        except Exception as e:
+            logger.error(f"技术Agent调用失败: {e}")
+            raise
         
         return self.safety_filter(result)
 
@@ -124,7 +264,7 @@ class TechAgent(BaseAgent):
 class ClassifyAgent(BaseAgent):
     """意图分类Agent"""
     
-    def generate(self, **args) -> str:
+    async def generate(self, **args) -> str:
         """
         生成意图分类
         
@@ -138,32 +278,19 @@ class ClassifyAgent(BaseAgent):
         
         # 构建专门用于分类的消息
         messages = [
-            {"role": "system", "content": f"【商品信息】{item_desc}\n【你与客户对话历史】{context}\n{self.system_prompt}\n\n请判断以下用户消息的意图类别：\n1. 如果是询问价格、议价、优惠、降价等，返回'price'\n2. 如果是询问商品技术细节、参数、功能、使用方法等，返回'tech'\n3. 其他情况返回'default'\n只需要返回对应的分类标签，不要返回其他内容。"},
+            {"role": "system", "content": f"{self.system_prompt}\n\n请判断以下用户消息的意图类别：\n1. 如果是询问价格、议价、优惠、降价等，返回'price'\n2. 如果是询问商品技术细节、参数、功能、使用方法等，返回'tech'\n3. 其他情况返回'default'\n只需要返回对应的分类标签，不要返回其他内容。\n【商品信息】{item_desc}\n【你与客户对话历史】{context}"},
             {"role": "user", "content": user_msg}
         ]
         
         # 获取环境变量中的轻量级模型设置（分类任务使用轻量级模型以节省成本）
         model = os.getenv("LLM_MODEL_LIGHT", "gpt-3.5-turbo")
         
-        # 调用LLM进行分类
-        def _execute_llm_call():
-            try:
-                response = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=0.1,  # 很低的温度，确保一致性
-                    max_tokens=10,  # 分类只需要很短的输出
-                    top_p=0.8
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                logger.error(f"分类Agent调用失败: {e}")
-                return "default"  # 出错时返回默认分类
-        
-        # 使用线程池执行
-        from .base import llm_executor
-        future = llm_executor.submit(_execute_llm_call)
-        intent = future.result()
+        # 调用LLM进行分类，使用很低的温度确保一致性，分类只需要很短的输出
+        try:
+            intent = await self._raw_llm(messages, model=model, temperature=0.1, max_tokens=10, top_p=0.8)
+        except Exception as e:
+            logger.error(f"分类Agent调用失败: {e}")
+            intent = "default"  # 出错时返回默认分类
         
         # 清理并规范化输出
         intent = intent.strip().lower()
@@ -180,7 +307,7 @@ class ClassifyAgent(BaseAgent):
 class DefaultAgent(BaseAgent):
     """默认回复Agent"""
     
-    def _call_llm(self, messages: List[Dict], *args) -> str:
+    async def _call_llm(self, messages: List[Dict], *args) -> str:
         """
         调用LLM生成默认回复
         
@@ -194,25 +321,11 @@ class DefaultAgent(BaseAgent):
         model = os.getenv("LLM_MODEL", "gpt-4-turbo")
         temp = float(os.getenv("LLM_TEMPERATURE", "0.7"))
         
-        # 定义执行函数
-        def _execute_llm_call():
-            try:
-                response = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=temp,
-                    max_tokens=400,
-                    top_p=0.9
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                logger.error(f"默认Agent调用失败: {e}")
-                return "您好，有什么我可以帮您的吗？"
-                
-        # 使用线程池执行
-        from .base import llm_executor
-        future = llm_executor.submit(_execute_llm_call)
-        return future.result()
+        try:
+            return await self._raw_llm(messages, model=model, temperature=temp, max_tokens=400, top_p=0.9)
+        except Exception as e:
+            logger.error(f"默认Agent调用失败: {e}")
+            raise
 
 
 class XianyuReplyBot:
@@ -220,62 +333,81 @@ class XianyuReplyBot:
     
     def __init__(self):
         """初始化闲鱼回复机器人"""
-        # 创建OpenAI客户端
-        from openai import OpenAI
-        import os
-        import time
-        
-        # 获取API设置
-        api_key = os.getenv("OPENAI_API_KEY")
-        api_base = os.getenv("OPENAI_BASE_URL")
-        
-        # 创建OpenAI客户端
-        client = OpenAI(
-            api_key=api_key,
-            base_url=api_base
-        )
         
-        # 定义安全过滤函数
-        def safety_filter(text):
-            """简单的安全过滤函数，可以根据需要扩展"""
-            blocked_phrases = ["微信", "QQ", "支付宝", "银行卡", "线下"]
-            return "[安全提醒]请通过平台沟通" if any(p in text for p in blocked_phrases) else text
-        
-        # 加载统一提示词
-        try:
-            prompt_path = os.path.join("prompts", "unified_prompt.txt")
-            with open(prompt_path, "r", encoding="utf-8") as f:
-                unified_prompt = f.read()
-                logger.info(f"已加载统一提示词，长度: {len(unified_prompt)} 字符")
-        except Exception as e:
-            logger.error(f"加载统一提示词时出错: {e}")
-            try:
-                # 尝试另一个路径
-                prompt_path = os.path.join("prompts", "unified_prompt.txt")
-                with open(prompt_path, "r", encoding="utf-8") as f:
-                    unified_prompt = f.read()
-                    logger.info(f"已加载统一提示词，长度: {len(unified_prompt)} 字符")
-            except Exception as e2:
-                logger.error(f"备用路径加载统一提示词时出错: {e2}")
-                # 提供一个后备提示词
-                unified_prompt = "你是闲鱼平台上卖家的智能助手，请帮助卖家回复买家的询问，保持礼貌和专业。"
-        
-        # 初始化Agent
-        self.agent = BaseAgent(client, unified_prompt, safety_filter)
+        # 初始化Agent，OpenAI客户端和提示词在所有实例间共享
+        self.agent = BaseAgent(_shared_client(), _unified_prompt(), safety_filter)
         
         # 兼容性处理，保留last_intent属性但始终设为'default'
         self.last_intent = 'default'
         
         # 添加消息去重机制
-        self.last_messages = {}  # 格式: {user_id: {"msg": "上一条消息", "time": 时间戳, "reply": "回复内容"}}
+        # 格式: {user_id: {"msg": "上一条消息", "time": 时间戳, "reply": "回复内容"}}，按写入时间排序
+        self.last_messages: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.last_messages_cap = 10000  # 最多记录的用户数量
         self.duplication_window = 20  # 20秒内相同消息视为重复
-        self.system_notices = [
-            "你已发货", "发来一条新消息", "已付款", "准备发货", "已下单", 
-            "已经付款", "买家留言", "快递信息", "物流更新", "发货提醒", 
-            "系统通知", "已收货", "已评价", "已退款", "订单更新"
-        ]
+        self.system_notices = _SYSTEM_NOTICES
+        
+        # 语义缓存，仅在配置了向量模型时启用
+        self.embedding_model = os.getenv("LLM_EMBEDDING_MODEL")
+        self.semantic_threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+        if self.embedding_model and not SEMANTIC_CACHE_AVAILABLE:
+            logger.error("缺少 'numpy' 库，无法启用语义缓存。请尝试运行 'pip install numpy' 安装。")
+            self.embedding_model = None
+        
+        # 回复缓存，不同用户的相同提问直接复用回复
+        # 持久化的缓存需要访问数据库，在首次生成回复时于事件循环外创建，此前只使用内存缓存
+        self.response_cache = ResponseCache()
+        self.semantic_cache = SemanticCache(threshold=self.semantic_threshold)
+        self._cache_prompt: Optional[str] = None
+        
+        # 推测执行模式：意图分类与专家Agent并发调用，以额外的模型调用换取更低的延迟
+        self.speculate = os.getenv("SPECULATE", "0") == "1"
+        if self.speculate:
+            client, system_prompt = self.agent.client, self.agent.system_prompt
+            self.classify_agent = ClassifyAgent(client, system_prompt, safety_filter)
+            self.price_agent = PriceAgent(client, system_prompt, safety_filter)
+            self.tech_agent = TechAgent(client, system_prompt, safety_filter)
+            self.default_agent = DefaultAgent(client, system_prompt, safety_filter)
+    
+    async def _refresh_prompt(self) -> None:
+        """提示词文件被修改时，更新所有Agent使用的提示词并重建缓存"""
+        prompt = _unified_prompt()
+        if prompt is self._cache_prompt:
+            return
+        # 先记录提示词，创建缓存期间到达的其他消息继续使用现有缓存，不会重复创建
+        self._cache_prompt = prompt
+        
+        if prompt is not self.agent.system_prompt:
+            agents = [self.agent]
+            if self.speculate:
+                agents += [self.classify_agent, self.price_agent, self.tech_agent, self.default_agent]
+            for agent in agents:
+                agent.system_prompt = prompt
+            logger.info("统一提示词已更新")
+        await self._build_caches(prompt)
+    
+    async def _build_caches(self, prompt: str) -> None:
+        """
+        创建回复缓存和语义缓存，以提示词的哈希作为命名空间，提示词变化后旧回复不再复用
+        
+        Args:
+            prompt: 当前使用的提示词
+        """
+        # 打开数据库和清理、加载记录都在其他线程中执行，不阻塞事件循环
+        db = await asyncio.get_running_loop().run_in_executor(None, _cache_db)
+        namespace = blake2b(prompt.encode('utf-8'), digest_size=8).hexdigest()
+        response_cache = await ResponseCache.create(db=db, namespace=namespace)
+        semantic_cache = await SemanticCache.create(
+            threshold=self.semantic_threshold,
+            db=db if self.embedding_model else None,
+            namespace=namespace
+        )
+        # 创建期间提示词可能再次变化，只保留最新提示词对应的缓存
+        if prompt is self._cache_prompt:
+            self.response_cache = response_cache
+            self.semantic_cache = semantic_cache
     
-    def generate_reply(self, user_msg: str, item_desc: str, context: Optional[str] = None, bargain_count: int = 0) -> str:
+    async def generate_reply(self, user_msg: str, item_desc: str, context: Optional[str] = None, bargain_count: int = 0) -> str:
         """
         生成回复
         
@@ -297,65 +429,70 @@ class XianyuReplyBot:
         if context is None or not isinstance(context, str):
             context = ""
         
+        await self._refresh_prompt()
+        
         # 消息去重检查
-        import time
         current_time = time.time()
         user_id = self._extract_user_id_from_context(context)
+        context = _truncate_tokens(context, _MAX_CONTEXT_TOKENS)
+        item_desc = _truncate_item_desc(item_desc) if isinstance(item_desc, str) else item_desc
         
         # 检查是否为系统通知类消息或可能在短时间内出现的重复消息
-        is_system_notice = any(notice in user_msg for notice in self.system_notices)
+        is_system_notice = _NOTICE_RE.search(user_msg) is not None
         
         # 检查10秒内是否有重复消息（对所有消息都检查）
-        if user_id in self.last_messages:
-            last_record = self.last_messages[user_id]
+        last_record = self.last_messages.get(user_id)
+        if last_record is not None:
             time_diff = current_time - last_record.get("time", 0)
             
             # 条件1: 完全相同的消息在短时间内重复
             if last_record.get("msg") == user_msg and time_diff < self.duplication_window:
-                logger.info(f"检测到{time_diff:.2f}秒内的完全相同消息，复用上一次回复")
+                logger.info("检测到{:.2f}秒内的完全相同消息，复用上一次回复", time_diff)
                 return last_record.get("reply", "收到您的消息，请问还有什么可以帮您的吗？")
             
             # 条件2: 系统通知类消息在短时间内出现
             if is_system_notice and time_diff < self.duplication_window:
-                logger.info(f"检测到{time_diff:.2f}秒内的系统通知类消息，使用简短回复")
+                logger.info("检测到{:.2f}秒内的系统通知类消息，使用简短回复", time_diff)
                 reply = "好的，收到！如有问题随时联系我~"
-                self.last_messages[user_id] = {
-                    "msg": user_msg,
-                    "time": current_time,
-                    "reply": reply
-                }
+                self._remember_message(user_id, user_msg, current_time, reply)
                 return reply
         
-        # 使用统一的Agent处理所有消息
-        messages = [
-            {"role": "system", "content": f"【商品信息】{item_desc if item_desc else 'unknown_item'}\n【你与客户对话历史】{context}\n【议价次数】{bargain_count}\n{self.agent.system_prompt}"},
-            {"role": "user", "content": user_msg}
-        ]
+        # 先查询回复缓存，命中则无需调用模型
+        cache_key = ResponseCache.make_key(item_desc or "", user_msg, bargain_count, context)
+        cached_reply = await self.response_cache.get(cache_key)
         
-        # 调用模型生成回复
-        def _execute_llm_call():
-            try:
-                # 获取环境变量中的模型设置
-                model = os.getenv("LLM_MODEL", "gpt-4-turbo")
-                base_temp = float(os.getenv("LLM_TEMPERATURE", "0.7"))
-                
-                response = self.agent.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=base_temp * 0.6 + min(bargain_count * 0.05, 0.3),  # 随议价次数略微增加温度
-                    max_tokens=500,
-                    top_p=0.8
-                )
-                return response.choices[0].message.content
-            except Exception as e:
-                logger.error(f"模型调用失败: {e}")
-                return "抱歉，系统繁忙，请稍后再试。"
+        # 精确缓存未命中时，再按语义相似度查找同一商品下的相近提问
+        semantic_bucket = f"{item_desc}\x1f{bargain_count}"
+        query_embedding = None
+        if cached_reply is None and self.embedding_model:
+            query_embedding = await self._embed(user_msg)
+            if query_embedding is not None:
+                cached_reply = self.semantic_cache.lookup(semantic_bucket, query_embedding)
+                if cached_reply is not None:
+                    self.response_cache.put(cache_key, cached_reply)
+        
+        messages, model, temperature = self._build_request(user_msg, item_desc, context, bargain_count)
         
         try:
-            # 使用线程池执行
-            from .base import llm_executor
-            future = llm_executor.submit(_execute_llm_call)
-            reply = future.result()
+            if cached_reply is not None:
+                reply = cached_reply
+            else:
+                # 调用模型生成回复，失败时抛出异常，只有模型真正生成的回复才写入缓存
+                try:
+                    if self.speculate:
+                        reply = await self._speculative_generate(user_msg, item_desc, context, bargain_count)
+                    else:
+                        reply = await self.agent._raw_llm(messages, model=model, temperature=temperature, max_tokens=500, top_p=0.8)
+                except Exception as e:
+                    logger.error(f"模型调用失败: {e}")
+                    reply = None
+                
+                if reply is None:
+                    reply = "抱歉，系统繁忙，请稍后再试。"
+                else:
+                    self.response_cache.put(cache_key, reply)
+                    if query_embedding is not None:
+                        self.semantic_cache.add(semantic_bucket, query_embedding, user_msg, reply)
             
             # 安全过滤
             reply = self.agent.safety_filter(reply)
@@ -363,44 +500,235 @@ class XianyuReplyBot:
             logger.error(f"生成回复过程中出错: {e}")
             reply = "您好，有什么我可以帮您的吗？"
         
+        self._record_reply(user_id, user_msg, current_time, reply)
+        
+        # 使用参数形式，日志级别高于DEBUG时不会格式化回复内容
+        logger.debug("生成回复: {}", reply)
+        return reply
+
+    async def stream_reply(self, user_msg: str, item_desc: str, context: Optional[str] = None, bargain_count: int = 0) -> AsyncIterator[str]:
+        """
+        流式生成回复，模型每生成一段文本就立即输出，降低首字延迟
+        
+        只使用精确缓存，不做去重和语义缓存查询。输出时始终暂缓最后几个字符，
+        一旦命中屏蔽词立即停止生成并输出安全提醒，屏蔽词不会被发送出去。
+        
+        Args:
+            user_msg: 用户消息
+            item_desc: 商品描述
+            context: 对话上下文
+            bargain_count: 议价次数
+            
+        Yields:
+            str: 回复的文本片段
+        """
+        if user_msg is None or user_msg.strip() == "":
+            yield "您好，有什么我可以帮您的吗？"
+            return
+        
+        if context is None or not isinstance(context, str):
+            context = ""
+        
+        await self._refresh_prompt()
+        current_time = time.time()
+        user_id = self._extract_user_id_from_context(context)
+        context = _truncate_tokens(context, _MAX_CONTEXT_TOKENS)
+        item_desc = _truncate_item_desc(item_desc) if isinstance(item_desc, str) else item_desc
+        
+        cache_key = ResponseCache.make_key(item_desc or "", user_msg, bargain_count, context)
+        cached_reply = await self.response_cache.get(cache_key)
+        if cached_reply is not None:
+            reply = self.agent.safety_filter(cached_reply)
+            self._record_reply(user_id, user_msg, current_time, reply)
+            yield reply
+            return
+        
+        messages, model, temperature = self._build_request(user_msg, item_desc, context, bargain_count)
+        
+        reply = ""
+        sent = 0
+        try:
+            async for piece in self.agent._stream_llm(messages, model=model, temperature=temperature, max_tokens=500, top_p=0.8):
+                reply += piece
+                # 只需检查新片段及其之前可能与之拼成屏蔽词的几个字符
+                if _BLOCKED_RE.search(reply, max(0, len(reply) - len(piece) - _BLOCKED_HOLDBACK)):
+                    logger.warning("流式回复命中屏蔽词，停止生成")
+                    reply = self.agent.safety_filter(reply)
+                    self._record_reply(user_id, user_msg, current_time, reply)
+                    yield reply
+                    return
+                
+                ready = len(reply) - _BLOCKED_HOLDBACK
+                if ready > sent:
+                    yield reply[sent:ready]
+                    sent = ready
+        except Exception as e:
+            logger.error(f"模型流式调用失败: {e}")
+            if not reply:
+                yield "抱歉，系统繁忙，请稍后再试。"
+                return
+        else:
+            self.response_cache.put(cache_key, reply)
+        
+        if sent < len(reply):
+            yield reply[sent:]
+        self._record_reply(user_id, user_msg, current_time, reply)
+        logger.debug("生成回复: {}", reply)
+
+    def _build_request(self, user_msg: str, item_desc: str, context: str, bargain_count: int) -> Tuple[List[Dict[str, str]], str, float]:
+        """
+        构建统一Agent的请求参数
+        
+        Args:
+            user_msg: 用户消息
+            item_desc: 商品描述
+            context: 对话上下文
+            bargain_count: 议价次数
+            
+        Returns:
+            Tuple[List[Dict[str, str]], str, float]: 消息链、模型名称和温度
+        """
+        # 使用统一的Agent处理所有消息，提示词在前以共享前缀缓存
+        messages = [
+            {"role": "system", "content": f"{self.agent.system_prompt}\n【商品信息】{item_desc if item_desc else 'unknown_item'}\n【议价次数】{bargain_count}\n【你与客户对话历史】{context}"},
+            {"role": "user", "content": user_msg}
+        ]
+        
+        # 获取环境变量中的模型设置，随议价次数略微增加温度
+        model = os.getenv("LLM_MODEL", "gpt-4-turbo")
+        base_temp = float(os.getenv("LLM_TEMPERATURE", "0.7"))
+        temperature = base_temp * 0.6 + min(bargain_count * 0.05, 0.3)
+        return messages, model, temperature
+
+    def _record_reply(self, user_id: str, user_msg: str, current_time: float, reply: str) -> None:
+        """
+        更新意图判断和最后回复记录
+        
+        Args:
+            user_id: 用户ID
+            user_msg: 用户消息
+            current_time: 消息时间戳
+            reply: 最终发送的回复
+        """
         # 判断是否为价格相关回复，用于保持议价次数增加的逻辑
-        price_keywords = ["价格", "优惠", "便宜", "贵", "元", "折扣", "价钱", "多少钱"]
-        if any(keyword in user_msg for keyword in price_keywords) or any(keyword in reply for keyword in price_keywords):
+        if _PRICE_RE.search(user_msg) or _PRICE_RE.search(reply):
             self.last_intent = 'price'
         else:
             self.last_intent = 'default'
         
         # 更新最后回复记录
+        self._remember_message(user_id, user_msg, current_time, reply)
+
+    def _remember_message(self, user_id: str, user_msg: str, current_time: float, reply: str) -> None:
+        """
+        记录用户最后一条消息和回复，并淘汰超出去重窗口或超出容量的记录
+        
+        Args:
+            user_id: 用户ID
+            user_msg: 用户消息
+            current_time: 消息时间戳
+            reply: 回复内容
+        """
         self.last_messages[user_id] = {
             "msg": user_msg,
             "time": current_time,
             "reply": reply
         }
+        self.last_messages.move_to_end(user_id)
+        
+        # 记录按写入时间排序，从最旧的一端清理过期记录
+        while self.last_messages:
+            oldest = next(iter(self.last_messages.values()))
+            if current_time - oldest["time"] < self.duplication_window and len(self.last_messages) <= self.last_messages_cap:
+                break
+            self.last_messages.popitem(last=False)
+
+    async def _speculative_generate(self, user_msg: str, item_desc: str, context: str, bargain_count: int) -> str:
+        """
+        推测执行：意图分类与最可能的两个专家Agent同时调用，分类结果返回后取消落选的调用
         
-        logger.debug(f"生成回复: {reply}")
-        return reply
+        Args:
+            user_msg: 用户消息
+            item_desc: 商品描述
+            context: 对话上下文
+            bargain_count: 议价次数
+            
+        Returns:
+            str: 生成的回复
+            
+        Raises:
+            Exception: 专家Agent调用失败时抛出
+        """
+        classify_task = asyncio.create_task(
+            self.classify_agent.generate(user_msg=user_msg, item_desc=item_desc, context=context)
+        )
+        expert_tasks = {
+            "price": asyncio.create_task(self.price_agent.generate(user_msg, item_desc, context, bargain_count)),
+            "default": asyncio.create_task(self.default_agent.generate(user_msg, item_desc, context, bargain_count)),
+        }
+        for task in expert_tasks.values():
+            # 落选的调用可能在取消前就已出错，取走异常以免事件循环报告未处理的异常
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        
+        try:
+            intent = await classify_task
+        except BaseException:
+            for task in expert_tasks.values():
+                task.cancel()
+            raise
+        
+        winner = expert_tasks.get(intent)
+        for task in expert_tasks.values():
+            if task is not winner:
+                task.cancel()
+        logger.debug("推测执行意图分类结果: {}", intent)
+        
+        if winner is None:
+            # 技术类问题较少，未做推测，分类完成后再调用
+            return await self.tech_agent.generate(user_msg, item_desc, context, bargain_count)
+        return await winner
+
+    async def _embed(self, text: str):
+        """
+        调用向量模型获取文本的归一化向量
+        
+        Args:
+            text: 待编码的文本
+            
+        Returns:
+            归一化后的向量，失败时返回None
+        """
+        try:
+            async with llm_semaphore():
+                response = await self.agent.client.embeddings.create(
+                    model=self.embedding_model,
+                    input=text
+                )
+            return SemanticCache.normalize(response.data[0].embedding)
+        except Exception as e:
+            logger.error(f"向量模型调用失败: {e}")
+            return None
+
+    def generate_reply_sync(self, *args, **kwargs) -> str:
+        """
+        同步版本的generate_reply，供不在事件循环中的旧调用方使用
+        
+        Returns:
+            str: 生成的回复
+        """
+        return asyncio.run(self.generate_reply(*args, **kwargs))
         
     def _extract_user_id_from_context(self, context: str) -> str:
         """从上下文中提取用户ID"""
-        import re
         if not isinstance(context, str):
             return "unknown_user"
             
-        # 尝试多种可能的格式匹配用户ID
-        patterns = [
-            r'user: (\d+)',
-            r'user[:\s]+(\w+)',
-            r'用户[:\s]+(\w+)',
-            r'买家[:\s]+(\w+)',
-            r'send_user_id[:\s]+(\w+)'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, context)
+        # 按优先级尝试多种可能的格式匹配用户ID
+        for pattern in _USER_ID_PATTERNS:
+            match = pattern.search(context)
             if match:
                 return match.group(1)
         
         # 如果找不到任何匹配，返回上下文的哈希值作为用户ID
-        import hashlib
-        context_hash = hashlib.md5(context.encode('utf-8')).hexdigest()[:8]
+        context_hash = blake2b(context.encode('utf-8'), digest_size=4).hexdigest()
         return f"user_{context_hash}" 
\ No newline at end of file
@@ -0,0 +1,101 @@
+"""
+WebSocket消息分类判断函数
+每一帧消息都要经过这些判断，独立成模块并补全类型注解，可以直接用mypyc编译为扩展模块：
+    mypyc src/api/_predicates.py
+未编译时按普通Python模块导入，行为一致
+"""
+
+from typing import Any, Optional
+
+
+def is_chat_message(message: Any) -> bool:
+    """
+    判断是否为聊天消息
+
+    Args:
+        message: 消息对象
+
+    Returns:
+        bool: 是否为聊天消息
+    """
+    if not isinstance(message, dict):
+        return False
+    body = message.get("1")
+    if not isinstance(body, dict):
+        return False
+    reminder = body.get("10")
+    return isinstance(reminder, dict) and "reminderContent" in reminder
+
+
+def is_sync_package(message_data: Any) -> bool:
+    """
+    判断是否为同步包
+
+    Args:
+        message_data: 消息数据
+
+    Returns:
+        bool: 是否为同步包
+    """
+    if not isinstance(message_data, dict):
+        return False
+    body = message_data.get("body")
+    if not isinstance(body, dict):
+        return False
+    package = body.get("syncPushPackage")
+    if not isinstance(package, dict):
+        return False
+    data = package.get("data")
+    return isinstance(data, list) and len(data) > 0
+
+
+def is_typing_status(message: Any) -> bool:
+    """
+    判断是否为输入状态消息
+
+    Args:
+        message: 消息对象
+
+    Returns:
+        bool: 是否为输入状态消息
+    """
+    if not isinstance(message, dict):
+        return False
+    body = message.get("1")
+
+    # 检查原始方法的判断条件
+    if isinstance(body, dict):
+        return "4" in body and body["4"] == 2
+
+    # 增加原始项目中的判断条件
+    if isinstance(body, list) and len(body) > 0:
+        first = body[0]
+        if isinstance(first, dict):
+            sender = first.get("1")
+            return isinstance(sender, str) and "@goofish" in sender
+    return False
+
+
+def find_pnm_message_id(message: Any) -> Optional[str]:
+    """
+    从消息中查找第一个带.PNM后缀的消息ID
+
+    Args:
+        message: 消息对象
+
+    Returns:
+        Optional[str]: 遍历到的第一个消息ID，不存在时返回None
+    """
+    # 深度优先遍历，子节点逆序入栈以保持字段的原始顺序，找到第一个即返回
+    stack = [message]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            if ".PNM" in value:
+                return value
+        elif isinstance(value, dict):
+            stack.extend(reversed(list(value.values())))
+        elif isinstance(value, list):
+            stack.extend(reversed(value))
+    return None
+
@@ -5,11 +5,17 @@
 
 import json
 import time
+from collections import OrderedDict
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from loguru import logger
 
 from ..utils.xianyu_utils import generate_sign, generate_device_id
 
+# 获取令牌接口使用的appKey
+_APP_KEY = "444e9908a51d1cb236a27862abc769c9"
+
 
 class XianyuApi:
     """闲鱼API接口类"""
@@ -34,6 +40,29 @@ class XianyuApi:
             'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36',
         }
         
+        # 复用连接池，避免每次请求都重新建立TCP+TLS连接
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=32,
+            # mtop接口均为带签名的POST请求，不可重复提交，只在请求未发出的连接失败时重试
+            max_retries=Retry(
+                total=2,
+                connect=2,
+                read=0,
+                status=0,
+                backoff_factor=0.3
+            )
+        )
+        self.session.mount("https://", adapter)
+        
+        # 商品信息缓存，格式: {item_id: (过期时间, 商品信息)}，失败结果也短暂缓存，避免反复请求
+        self._item_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._item_ttl = 60
+        self._item_ttl_err = 5
+        self._item_cache_size = 4096
+        
     def _build_params(self, api, t, sign):
         """
         构建通用请求参数
@@ -81,8 +110,8 @@ class XianyuApi:
             return None
             
         api = 'mtop.taobao.idlemessage.pc.login.token'
-        t = str(int(time.time()) * 1000)
-        data_val = f'{{"appKey":"444e9908a51d1cb236a27862abc769c9","deviceId":"{device_id}"}}'
+        t = str(time.time_ns() // 1_000_000)
+        data_val = json.dumps({"appKey": _APP_KEY, "deviceId": device_id}, separators=(",", ":"))
         
         # 获取token并生成签名
         try:
@@ -100,7 +129,7 @@ class XianyuApi:
         # 发送请求
         url = f"{self.base_url}{api}/1.0/"
         try:
-            response = requests.post(url, params=params, cookies=cookies, headers=self.headers, data=data)
+            response = self.session.post(url, params=params, cookies=cookies, data=data, timeout=(3, 10))
             res_json = response.json()
             return res_json
         except Exception as e:
@@ -109,7 +138,7 @@ class XianyuApi:
 
     def get_item_info(self, cookies, item_id):
         """
-        获取商品信息
+        获取商品信息，同一商品的结果缓存一段时间
         
         Args:
             cookies (dict): Cookies字典
@@ -118,9 +147,35 @@ class XianyuApi:
         Returns:
             dict: 商品信息的JSON数据
         """
+        key = str(item_id)
+        now = time.monotonic()
+        hit = self._item_cache.get(key)
+        if hit is not None and now < hit[0]:
+            self._item_cache.move_to_end(key)
+            return hit[1]
+        
+        res_json = self._fetch_item_info(cookies, item_id)
+        ttl = self._item_ttl if res_json is not None else self._item_ttl_err
+        self._item_cache[key] = (now + ttl, res_json)
+        self._item_cache.move_to_end(key)
+        while len(self._item_cache) > self._item_cache_size:
+            self._item_cache.popitem(last=False)
+        return res_json
+
+    def _fetch_item_info(self, cookies, item_id):
+        """
+        请求商品信息接口
+        
+        Args:
+            cookies (dict): Cookies字典
+            item_id (str): 商品ID
+            
+        Returns:
+            dict: 商品信息的JSON数据，请求失败时返回None
+        """
         api = 'mtop.taobao.idle.pc.detail'
-        t = str(int(time.time()) * 1000)
-        data_val = f'{{"itemId":"{item_id}"}}'
+        t = str(time.time_ns() // 1_000_000)
+        data_val = json.dumps({"itemId": str(item_id)}, separators=(",", ":"))
         
         try:
             token = cookies['_m_h5_tk'].split('_')[0]
@@ -135,7 +190,7 @@ class XianyuApi:
         
         url = f"{self.base_url}{api}/1.0/"
         try:
-            response = requests.post(url, params=params, cookies=cookies, headers=self.headers, data=data)
+            response = self.session.post(url, params=params, cookies=cookies, data=data, timeout=(3, 10))
             res_json = response.json()
             return res_json
         except Exception as e:
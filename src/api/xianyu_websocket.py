@@ -4,25 +4,348 @@
 """
 
 import asyncio
-import base64
+from binascii import a2b_base64
+from collections import OrderedDict
+import hashlib
 import json
+from json.encoder import encode_basestring
+import random
 import time
-from typing import Callable, Dict, Optional
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Callable, Dict, Optional, Tuple
 import websockets
+from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory
 from loguru import logger
-import concurrent.futures
-from queue import Queue
-from threading import Thread
 import os
 
+try:
+    # pybase64使用SIMD指令加速，接口与标准库一致
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 消息解析热路径上直接引用，省去每次的模块属性查找；
+# 没有pybase64时直接调用binascii.a2b_base64，跳过标准库b64decode对输入的检查和转换
+_b64decode = base64.b64decode if base64.__name__ == "pybase64" else a2b_base64
+
+# 重连等待时间上限的初始值和最大值（秒）
+_RECONNECT_BACKOFF_MIN = 1.0
+_RECONNECT_BACKOFF_MAX = 60.0
+
+# 超过该长度（base64字符数）的加密消息放到线程池中解码，普通聊天消息远小于该值，直接在事件循环中解码更快
+_DECODE_OFFLOAD_SIZE = 64 * 1024
+
 from utils.xianyu_utils import generate_mid, generate_uuid, trans_cookies, generate_device_id, decrypt, get_login_cookies, cookies_dict_to_str
 from utils.xianyu_apis import XianyuApis
+from utils.keyword_matcher import KeywordMatcher
 from core.context_manager import ChatContextManager
+from api._predicates import is_chat_message, is_sync_package, is_typing_status, find_pnm_message_id
+
+
+
+# 只读的空字典，用于.get(key) or _EMPTY，避免每次取不到值时新建空字典
+_EMPTY = MappingProxyType({})
+
+# base64编码后的JSON对象/数组的首字符
+_PLAIN_B64_PREFIXES = ("e", "W", b"e", b"W")
+
+
+# 进程内共享的线程池，格式: {名称: 线程池}
+_executors: Dict[str, ThreadPoolExecutor] = {}
+
+
+def _shared_executor(name: str, max_workers: int) -> ThreadPoolExecutor:
+    """
+    按名称获取共享线程池，首次使用时创建
+    
+    多个XianyuLive实例（例如每个账号一个）共用同一组线程，线程数不会随实例数量增长
+    
+    Args:
+        name: 线程池名称，同时作为线程名前缀
+        max_workers: 首次创建时的最大线程数
+        
+    Returns:
+        ThreadPoolExecutor: 线程池
+    """
+    executor = _executors.get(name)
+    if executor is None:
+        executor = _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+    return executor
+
+
+def _dumps_bytes(obj) -> bytes:
+    """将对象序列化为UTF-8编码的JSON字节串，优先使用orjson"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _dumps(obj) -> str:
+    """将对象序列化为JSON字符串，用于发送WebSocket文本帧"""
+    return _dumps_bytes(obj).decode("utf-8")
+
+
+def _format_for_log(obj, limit: int = 1000) -> str:
+    """将消息转换为日志文本，超过长度限制时截断"""
+    text = json.dumps(obj, ensure_ascii=False)
+    if len(text) > limit:
+        return f"{text[:limit]}...（内容过长已截断）"
+    return text
+
+
+# 内容与之完全相同的消息视为系统通知，需要输出分析日志
+_NOTICE_MESSAGES = frozenset(("发来一条新消息", "新消息", "系统通知"))
+
+# 调试日志中记录的聊天消息关键字段
+_IMPORTANT_FIELDS = ("1", "2", "3", "4", "5", "6", "10", "11", "20", "24")
+
+
+def _important_fields(message: dict) -> dict:
+    """提取聊天消息的关键字段，用于日志分析"""
+    important_fields = {}
+    for field in _IMPORTANT_FIELDS:
+        if field in message and field != "1":  # 排除1字段，因为它是整个消息的主体
+            important_fields[field] = message[field]
+        elif field in message["1"] and not isinstance(message["1"], list):
+            important_fields[field] = message["1"][field]
+    return important_fields
+
+
+def _describe_sync_data(message_data: dict) -> str:
+    """描述同步包数据的类型、长度和哈希值，方便调试时判断数据是否有变化"""
+    try:
+        sync_data = message_data["body"]["syncPushPackage"]["data"][0]
+        if "data" not in sync_data:
+            return f"同步包数据类型: {type(sync_data).__name__}"
+        raw = str(sync_data["data"])
+        return f"同步包数据类型: {type(sync_data).__name__}，长度: {len(raw)}，哈希值: {hash(raw)}"
+    except Exception as e:
+        return f"记录同步包数据时出错: {e}"
+
+
+def _json_value(value) -> str:
+    """将单个值编码为JSON片段，字符串直接转义，无需经过完整的序列化流程"""
+    if isinstance(value, str):
+        return encode_basestring(value)
+    return _dumps(value)
+
+
+def _build_ack(headers: dict) -> str:
+    """
+    拼接ACK响应帧，结构与 {"code":200,"headers":{mid, sid, app-key, ua, dt}} 一致
+    
+    Args:
+        headers: 收到的消息头部
+        
+    Returns:
+        str: ACK响应的JSON文本
+    """
+    # 每个字段只用get查找一次
+    mid = headers.get("mid")
+    if mid is None:
+        mid = generate_mid()
+    parts = [
+        '{"code":200,"headers":{"mid":', _json_value(mid),
+        ',"sid":', _json_value(headers.get("sid", '')),
+    ]
+    for key in ("app-key", "ua", "dt"):
+        value = headers.get(key)
+        if value is not None:
+            parts.extend((',"', key, '":', _json_value(value)))
+    parts.append('}}')
+    return ''.join(parts)
+
+
+# 发送消息体中固定不变的字段，只需补充uuid、cid、content和extension
+_SEND_BODY_TEMPLATE = {
+    "conversationType": 1,
+    "redPointPolicy": 0,
+    "ctx": {
+        "appVersion": "1.0",
+        "platform": "web"
+    },
+    "mtags": {},
+    "msgReadStatusSetting": 1
+}
+
+# 发送帧中的常量片段在模块加载时序列化一次，发送时只拼接变化的字段
+_SEND_FRAME_HEAD = '{"lwp":"/r/MessageSend/sendByReceiverScope","headers":{"mid":'
+_SEND_FRAME_BODY = '},"body":[{' + _dumps(_SEND_BODY_TEMPLATE)[1:-1] + ',"uuid":'
+_SEND_FRAME_CID = ',"cid":'
+_SEND_FRAME_DATA = ',"content":{"contentType":101,"custom":{"type":1,"data":"'
+_SEND_FRAME_EXT = '"}},"extension":{"extJson":'
+_SEND_FRAME_RECEIVERS = '}},{"actualReceivers":['
+_SEND_FRAME_TAIL = ']}]}'
+_GOOFISH_SUFFIX = '@goofish'
+_EMPTY_EXT = _json_value("{}")
+
+
+@lru_cache(maxsize=1024)
+def _conversation_fragments(myid: str, cid: str, toid: str) -> Tuple[str, str]:
+    """
+    生成发送帧中只与会话相关的片段，同一会话连续回复时直接复用
+    
+    Args:
+        myid: 自己的用户ID
+        cid: 会话ID
+        toid: 接收者ID
+        
+    Returns:
+        Tuple[str, str]: (cid到data字段之前的片段, 接收者列表到帧结尾的片段)
+    """
+    cid_part = _SEND_FRAME_CID + _json_value(cid + _GOOFISH_SUFFIX) + _SEND_FRAME_DATA
+    receivers_part = (
+        _SEND_FRAME_RECEIVERS + _json_value(toid + _GOOFISH_SUFFIX) + ','
+        + _json_value(myid + _GOOFISH_SUFFIX) + _SEND_FRAME_TAIL
+    )
+    return cid_part, receivers_part
+
+
+def _build_send_frame(myid: str, cid: str, toid: str, text: str, reply_to_message_id: Optional[str] = None) -> str:
+    """
+    构建发送消息的WebSocket帧，结构与
+    {"lwp", "headers": {mid}, "body": [{模板字段, uuid, cid, content, extension}, {actualReceivers}]} 一致
+    
+    Args:
+        myid: 自己的用户ID
+        cid: 会话ID
+        toid: 接收者ID
+        text: 消息文本
+        reply_to_message_id: 引用回复的消息ID
+        
+    Returns:
+        str: 待发送的JSON文本
+    """
+    # base64编码只包含字母、数字和+/=，无需转义
+    text_base64 = base64.b64encode(_dumps_bytes({"contentType": 1, "text": {"text": text}})).decode('ascii')
+    
+    # 准备extension字段
+    ext_json = _EMPTY_EXT
+    if reply_to_message_id:
+        # 检查消息ID格式
+        if ".PNM" not in reply_to_message_id:
+            logger.warning("【警告】引用的消息ID {} 不包含.PNM后缀，可能导致引用回复失败", reply_to_message_id)
+        # 构建引用回复的extension
+        ext_json = _json_value('{"replyMessageId":' + _json_value(reply_to_message_id) + '}')
+        logger.info("构建引用回复，引用消息ID: {}", reply_to_message_id)
+    
+    cid_part, receivers_part = _conversation_fragments(myid, cid, toid)
+    return ''.join((
+        _SEND_FRAME_HEAD, _json_value(generate_mid()),
+        _SEND_FRAME_BODY, _json_value(generate_uuid()),
+        cid_part, text_base64,
+        _SEND_FRAME_EXT, ext_json,
+        receivers_part,
+    ))
+
+
+def _loads(data):
+    """解析JSON，支持str和bytes，优先使用orjson"""
+    # orjson内部缓存短键名的字符串对象，重复出现的"contentType"、"data"等键无需再手动sys.intern
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_object(text) -> Optional[dict]:
+    """
+    解析消息中以字符串保存的JSON对象字段（如bizTag、extJson）
+    
+    Args:
+        text: 字段的原始字符串
+        
+    Returns:
+        Optional[dict]: 解析得到的对象，字段为空、解析失败或不是对象时返回None
+    """
+    if not text or not isinstance(text, str):
+        return None
+    try:
+        value = _loads(text)
+    except Exception:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def _describe_notice(reminder: dict, biz_tag_obj: Optional[dict], ext_json_obj: Optional[dict]) -> str:
+    """汇总系统通知的标题、内容、URL、任务信息和参数，用于分析日志"""
+    parts = [
+        f"标题: {reminder.get('reminderTitle', '')}",
+        f"内容: {reminder.get('reminderContent', '')}",
+        f"URL: {reminder.get('reminderUrl', '')}",
+    ]
+    if biz_tag_obj is not None:
+        parts.append(f"任务名称: {biz_tag_obj.get('taskName', '')}")
+        parts.append(f"任务ID: {biz_tag_obj.get('taskId', '')}")
+    elif reminder.get("bizTag"):
+        parts.append("bizTag解析失败")
+    if ext_json_obj is not None:
+        parts.append(f"参数: {ext_json_obj.get('msgArgs', {})}")
+    elif reminder.get("extJson"):
+        parts.append("extJson解析失败")
+    return "，".join(parts)
+
+
+def _decrypt_message(data) -> Tuple[object, bool]:
+    """
+    解密同步包数据并解析为消息对象，解密和JSON解析在同一线程中完成
+    
+    Args:
+        data: base64编码的加密数据
+        
+    Returns:
+        Tuple[object, bool]: (消息对象, 解密后的原文中是否出现.PNM)
+    """
+    text = decrypt(data)
+    # 在原文上做一次子串查找，不含.PNM的消息无需再遍历解析后的对象
+    return _loads(text), ".PNM" in text
 
 
 class XianyuWebSocket:
     """闲鱼WebSocket客户端类"""
     
+    # 注册消息中固定不变的头部字段
+    _REG_HEADERS = {
+        "cache-header": "app-key token ua wv",
+        "app-key": "444e9908a51d1cb236a27862abc769c9",
+        "ua": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36 DingTalk(2.1.5) OS(Windows/10) Browser(Chrome/133.0.0.0) DingWeb/2.1.5 IMPaaS DingWeb/2.1.5",
+        "dt": "j",
+        "wv": "im:3,au:3,sy:6",
+        "sync": "0,0;0;0;",
+    }
+    
+    # 建立WebSocket连接时固定不变的请求头，Cookie在每次连接时单独加上
+    _WS_HEADERS = {
+        "Host": "wss-goofish.dingtalk.com",
+        "Connection": "Upgrade",
+        "Pragma": "no-cache",
+        "Cache-Control": "no-cache",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36",
+        "Origin": "https://www.goofish.com",
+        "Accept-Encoding": "gzip, deflate, br, zstd",
+        "Accept-Language": "zh-CN,zh;q=0.9",
+    }
+    
+    # 同步状态确认消息中固定不变的字段
+    _SYNC_ACK_BODY = {
+        "pipeline": "sync",
+        "tooLong2Tag": "PNM,1",
+        "channel": "sync",
+        "topic": "sync",
+        "highPts": 0,
+        "seq": 0,
+    }
+    
+    # 心跳包 {"lwp":"/!","headers":{"mid":...}} 的前后缀，mid只包含数字和空格，无需转义
+    _HB_PREFIX = '{"lwp":"/!","headers":{"mid":"'
+    _HB_SUFFIX = '"}}'
+    
     def __init__(self, cookies_str: str, message_handler: Callable):
         """
         初始化WebSocket客户端
@@ -58,7 +381,13 @@ class XianyuWebSocket:
         # 生成设备ID
         self.device_id = generate_device_id(self.myid)
         
-        # 心跳相关配置
+        # 重连时复用同一个API客户端，保持HTTP连接池不被重建
+        self.xianyu_apis = XianyuApis()
+        
+        # 大消息的解码使用独立的线程池，不与对话历史读写等其他阻塞任务争抢线程
+        self.decode_executor = _shared_executor("xy-decode", 2)
+        
+        # 心跳相关配置，时间戳使用time.monotonic()，不受系统时间调整影响
         self.heartbeat_interval = 15  # 心跳间隔15秒
         self.heartbeat_timeout = 5    # 心跳超时5秒
         self.last_heartbeat_time = 0
@@ -78,8 +407,10 @@ class XianyuWebSocket:
             ws: WebSocket连接对象
         """
         try:
-            xianyu_apis = XianyuApis()
-            token_info = xianyu_apis.get_token(self.cookies, self.device_id)
+            # requests是阻塞调用，放到线程中执行，避免卡住事件循环上的消息消费者
+            token_info = await asyncio.get_running_loop().run_in_executor(
+                None, self.xianyu_apis.get_token, self.cookies, self.device_id
+            )
             
             # 首先检查是否有accessToken，有则代表成功
             if token_info and 'data' in token_info and 'accessToken' in token_info['data']:
@@ -105,24 +436,20 @@ class XianyuWebSocket:
             msg = {
                 "lwp": "/reg",
                 "headers": {
-                    "cache-header": "app-key token ua wv",
-                    "app-key": "444e9908a51d1cb236a27862abc769c9",
+                    **self._REG_HEADERS,
                     "token": token,
-                    "ua": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36 DingTalk(2.1.5) OS(Windows/10) Browser(Chrome/133.0.0.0) DingWeb/2.1.5 IMPaaS DingWeb/2.1.5",
-                    "dt": "j",
-                    "wv": "im:3,au:3,sy:6",
-                    "sync": "0,0;0;0;",
                     "did": self.device_id,
                     "mid": generate_mid()
                 }
             }
-            await ws.send(json.dumps(msg))
+            await ws.send(_dumps(msg))
             logger.info("已发送WebSocket注册消息")
             
             # 等待一段时间，确保连接注册完成
             await asyncio.sleep(1)
             
             # 发送同步状态确认消息，这是原始项目中的关键步骤
+            now_ms = int(time.time() * 1000)
             sync_msg = {
                 "lwp": "/r/SyncStatus/ackDiff", 
                 "headers": {
@@ -130,18 +457,13 @@ class XianyuWebSocket:
                 }, 
                 "body": [
                     {
-                        "pipeline": "sync", 
-                        "tooLong2Tag": "PNM,1", 
-                        "channel": "sync", 
-                        "topic": "sync", 
-                        "highPts": 0,
-                        "pts": int(time.time() * 1000) * 1000, 
-                        "seq": 0, 
-                        "timestamp": int(time.time() * 1000)
+                        **self._SYNC_ACK_BODY,
+                        "pts": now_ms * 1000,
+                        "timestamp": now_ms
                     }
                 ]
             }
-            await ws.send(json.dumps(sync_msg))
+            await ws.send(_dumps(sync_msg))
             logger.info('连接注册完成')
             
         except Exception as e:
@@ -159,75 +481,14 @@ class XianyuWebSocket:
             text (str): 消息文本
             reply_to_message_id (str, optional): 引用回复的消息ID
         """
-        text_obj = {
-            "contentType": 1,
-            "text": {
-                "text": text
-            }
-        }
-        text_base64 = str(base64.b64encode(json.dumps(text_obj).encode('utf-8')), 'utf-8')
+        frame = _build_send_frame(self.myid, cid, toid, text, reply_to_message_id)
         
-        # 准备extension字段
-        ext_json = "{}"
-        if reply_to_message_id:
-            # 检查消息ID格式
-            if ".PNM" not in reply_to_message_id:
-                logger.warning(f"【警告】引用的消息ID {reply_to_message_id} 不包含.PNM后缀，可能导致引用回复失败")
-                
-            # 构建引用回复的extension
-            ext_json = "{\"replyMessageId\":\"" + reply_to_message_id + "\"}"
-            logger.info(f"构建引用回复，引用消息ID: {reply_to_message_id}")
-            
-        msg = {
-            "lwp": "/r/MessageSend/sendByReceiverScope",
-            "headers": {
-                "mid": generate_mid()
-            },
-            "body": [
-                {
-                    "uuid": generate_uuid(),
-                    "cid": f"{cid}@goofish",
-                    "conversationType": 1,
-                    "content": {
-                        "contentType": 101,
-                        "custom": {
-                            "type": 1,
-                            "data": text_base64
-                        }
-                    },
-                    "redPointPolicy": 0,
-                    "extension": {
-                        "extJson": ext_json
-                    },
-                    "ctx": {
-                        "appVersion": "1.0",
-                        "platform": "web"
-                    },
-                    "mtags": {},
-                    "msgReadStatusSetting": 1
-                },
-                {
-                    "actualReceivers": [
-                        f"{toid}@goofish",
-                        f"{self.myid}@goofish"
-                    ]
-                }
-            ]
-        }
-        
-        # 记录完整的发送消息 - 添加更详细的日志记录
-        logger.info("====================【开始-发送消息日志】====================")
-        logger.info(f"发送WebSocket消息 -> 回复用户: {toid}")
-        logger.info(f"消息内容: {text}")
-        logger.info(f"是否引用回复: {reply_to_message_id is not None}")
-        if reply_to_message_id:
-            logger.info(f"引用消息ID: {reply_to_message_id}")
-        logger.info(f"完整消息结构: {json.dumps(msg, ensure_ascii=False, indent=2)}")
-        logger.info("====================【结束-发送消息日志】====================")
+        # 每条回复只记录一行摘要，完整消息结构仅在DEBUG级别下才格式化
+        logger.info("发送消息 -> 用户: {}，引用消息ID: {}，内容: {}", toid, reply_to_message_id, text)
+        logger.opt(lazy=True).debug("完整消息结构: {}", lambda: json.dumps(json.loads(frame), ensure_ascii=False, indent=2))
         
         # 发送消息
-        await ws.send(json.dumps(msg))
-        logger.info("消息发送完成")
+        await ws.send(frame)
     
     @staticmethod
     async def send_msg_static(ws, cid, toid, text, cookies, reply_to_message_id=None):
@@ -242,184 +503,29 @@ class XianyuWebSocket:
             cookies (dict): Cookies字典
             reply_to_message_id (str, optional): 引用回复的消息ID
         """
-        # 提取用户ID
-        myid = cookies['unb']
-        
-        # 构建消息对象
-        text_obj = {
-            "contentType": 1,
-            "text": {
-                "text": text
-            }
-        }
-        text_base64 = str(base64.b64encode(json.dumps(text_obj).encode('utf-8')), 'utf-8')
-        
-        # 准备extension字段
-        ext_json = "{}"
-        if reply_to_message_id:
-            # 检查消息ID格式
-            if ".PNM" not in reply_to_message_id:
-                logger.warning(f"【警告】引用的消息ID {reply_to_message_id} 不包含.PNM后缀，可能导致引用回复失败")
-                
-            # 构建引用回复的extension
-            ext_json = "{\"replyMessageId\":\"" + reply_to_message_id + "\"}"
-            logger.info(f"构建引用回复，引用消息ID: {reply_to_message_id}")
-            
-        msg = {
-            "lwp": "/r/MessageSend/sendByReceiverScope",
-            "headers": {
-                "mid": generate_mid()
-            },
-            "body": [
-                {
-                    "uuid": generate_uuid(),
-                    "cid": f"{cid}@goofish",
-                    "conversationType": 1,
-                    "content": {
-                        "contentType": 101,
-                        "custom": {
-                            "type": 1,
-                            "data": text_base64
-                        }
-                    },
-                    "redPointPolicy": 0,
-                    "extension": {
-                        "extJson": ext_json
-                    },
-                    "ctx": {
-                        "appVersion": "1.0",
-                        "platform": "web"
-                    },
-                    "mtags": {},
-                    "msgReadStatusSetting": 1
-                },
-                {
-                    "actualReceivers": [
-                        f"{toid}@goofish",
-                        f"{myid}@goofish"
-                    ]
-                }
-            ]
-        }
+        frame = _build_send_frame(cookies['unb'], cid, toid, text, reply_to_message_id)
         
         # 发送消息
-        logger.info(f"发送消息 -> 回复用户: {toid}, 内容: {text[:20]}...")
-        await ws.send(json.dumps(msg))
+        logger.info("发送消息 -> 回复用户: {}, 内容: {}...", toid, text[:20])
+        await ws.send(frame)
         logger.info("消息发送完成")
     
     def is_chat_message(self, message):
-        """
-        判断是否为聊天消息
-        
-        Args:
-            message: 消息对象
-            
-        Returns:
-            bool: 是否为聊天消息
-        """
-        try:
-            # 检查是否为有效的聊天消息
-            return (
-                isinstance(message, dict) 
-                and "1" in message 
-                and isinstance(message["1"], dict)  # 确保是字典类型
-                and "10" in message["1"]
-                and isinstance(message["1"]["10"], dict)  # 确保是字典类型
-                and "reminderContent" in message["1"]["10"]
-            )
-        except Exception:
-            return False
+        """判断是否为聊天消息"""
+        return is_chat_message(message)
     
     def is_sync_package(self, message_data):
-        """
-        判断是否为同步包
-        
-        Args:
-            message_data: 消息数据
-            
-        Returns:
-            bool: 是否为同步包
-        """
-        try:
-            return (
-                isinstance(message_data, dict)
-                and "body" in message_data
-                and "syncPushPackage" in message_data["body"]
-                and "data" in message_data["body"]["syncPushPackage"]
-                and len(message_data["body"]["syncPushPackage"]["data"]) > 0
-            )
-        except Exception:
-            return False
+        """判断是否为同步包"""
+        return is_sync_package(message_data)
     
     def is_typing_status(self, message):
-        """
-        判断是否为输入状态消息
-        
-        Args:
-            message: 消息对象
-            
-        Returns:
-            bool: 是否为输入状态消息
-        """
-        try:
-            # 检查原始方法的判断条件
-            if (isinstance(message, dict) and 
-                    "1" in message and 
-                    isinstance(message["1"], dict) and 
-                    "4" in message["1"] and 
-                    message["1"]["4"] == 2):
-                return True
-                
-            # 增加原始项目中的判断条件
-            if (isinstance(message, dict) and 
-                "1" in message and 
-                isinstance(message["1"], list) and 
-                len(message["1"]) > 0 and 
-                isinstance(message["1"][0], dict) and 
-                "1" in message["1"][0] and 
-                isinstance(message["1"][0]["1"], str) and 
-                "@goofish" in message["1"][0]["1"]):
-                return True
-                
-            return False
-        except Exception:
-            return False
+        """判断是否为输入状态消息"""
+        return is_typing_status(message)
             
     def extract_message_id_from_non_chat(self, message):
-        """从非聊天消息中提取消息ID，优先返回带.PNM后缀的ID"""
+        """从非聊天消息中提取消息ID，返回遍历到的第一个带.PNM后缀的ID"""
         try:
-            pnm_ids = []  # 存储所有找到的PNM格式ID
-            
-            # 1. 直接检查message["1"]字段是否为带PNM的字符串
-            if "1" in message and isinstance(message["1"], str) and ".PNM" in message["1"]:
-                pnm_ids.append(message["1"])
-                
-            # 2. 检查message["1"]是否为列表，且包含PNM字符串
-            elif "1" in message and isinstance(message["1"], list):
-                for item in message["1"]:
-                    if isinstance(item, str) and ".PNM" in item:
-                        pnm_ids.append(item)
-                        
-            # 3. 检查其他顶级字段
-            for key, value in message.items():
-                if isinstance(value, str) and ".PNM" in value:
-                    pnm_ids.append(value)
-                elif isinstance(value, list):
-                    for item in value:
-                        if isinstance(item, str) and ".PNM" in item:
-                            pnm_ids.append(item)
-                elif isinstance(value, dict):
-                    for sub_key, sub_value in value.items():
-                        if isinstance(sub_value, str) and ".PNM" in sub_value:
-                            pnm_ids.append(sub_value)
-            
-            # 如果找到多个ID，记录在日志中
-            if len(pnm_ids) > 1:
-                logger.info(f"从非聊天消息中找到多个带PNM后缀的ID: {pnm_ids}，使用第一个")
-                
-            # 返回第一个找到的ID，没有则返回None
-            return pnm_ids[0] if pnm_ids else None
-            
+            return find_pnm_message_id(message)
         except Exception as e:
             logger.error(f"从非聊天消息提取ID时出错: {e}")
             return None
@@ -433,50 +539,26 @@ class XianyuWebSocket:
             websocket: WebSocket连接对象
         """
         try:
-            # 记录接收到的原始消息
-            if self.is_sync_package(message_data):
-                logger.info("====================【开始-接收消息日志】====================")
-                logger.info(f"接收到WebSocket消息: {type(message_data).__name__}")
-                logger.info(f"消息头部: {json.dumps(message_data.get('headers', {}), ensure_ascii=False)}")
-                
-                # 尝试记录同步包数据
-                try:
-                    sync_data = message_data["body"]["syncPushPackage"]["data"][0]
-                    logger.info(f"同步包数据类型: {type(sync_data).__name__}")
-                    if "data" in sync_data:
-                        logger.info(f"同步包数据长度: {len(str(sync_data['data']))}")
-                        # 添加数据哈希值记录，方便判断数据是否有变化
-                        data_hash = hash(str(sync_data['data']))
-                        logger.info(f"同步包数据哈希值: {data_hash}")
-                except Exception as e:
-                    logger.debug(f"记录同步包数据时出错: {e}")
-                
-                logger.info("====================【结束-接收消息日志】====================")
+            is_sync = self.is_sync_package(message_data)
+            
+            # 记录接收到的同步包，只用于调试，未开启DEBUG日志时不做序列化和哈希计算
+            if is_sync:
+                logger.opt(lazy=True).debug(
+                    "接收到同步包消息，头部: {}，{}",
+                    lambda: json.dumps(message_data.get('headers', {}), ensure_ascii=False),
+                    lambda: _describe_sync_data(message_data)
+                )
             
             # 发送ACK响应 - 从XianyuAutoAgent添加
             try:
-                message = message_data
-                ack = {
-                    "code": 200,
-                    "headers": {
-                        "mid": message["headers"]["mid"] if "mid" in message["headers"] else generate_mid(),
-                        "sid": message["headers"]["sid"] if "sid" in message["headers"] else '',
-                    }
-                }
-                if 'app-key' in message["headers"]:
-                    ack["headers"]["app-key"] = message["headers"]["app-key"]
-                if 'ua' in message["headers"]:
-                    ack["headers"]["ua"] = message["headers"]["ua"]
-                if 'dt' in message["headers"]:
-                    ack["headers"]["dt"] = message["headers"]["dt"]
-                await websocket.send(json.dumps(ack))
+                await websocket.send(_build_ack(message_data["headers"]))
             except Exception as e:
                 pass
             
             # 如果不是同步包消息，直接返回
-            if not self.is_sync_package(message_data):
+            if not is_sync:
                 # 如果有消息处理函数，调用它处理非同步包消息
-                if self.message_handler and self.message_handler != self.handle_message:
+                if self.message_handler is not None:
                     await self.message_handler(message_data, websocket)
                 return
 
@@ -491,43 +573,41 @@ class XianyuWebSocket:
             # 解密数据
             data = sync_data["data"]
             
-            # 先尝试base64解码，如果成功则是未加密消息
-            try:
-                decoded_data = base64.b64decode(data).decode("utf-8")
-                json_data = json.loads(decoded_data)
-                logger.debug("无需解密的消息")
-                # 记录未加密消息的内容
-                message_str = json.dumps(json_data, ensure_ascii=False)
-                if len(message_str) > 1000:
-                    logger.info(f"未加密消息内容(截取): {message_str[:1000]}...（内容过长已截断）")
-                else:
-                    logger.info(f"未加密消息内容: {message_str}")
-                
-                # 如果有消息处理函数，调用它处理解密后的消息
-                if self.message_handler and self.message_handler != self.handle_message:
-                    await self.message_handler(message_data, websocket)
-                return
-            except Exception as e:
-                # 解码失败，说明需要解密
-                logger.debug(f"需要解密的消息: {e}")
+            # 未加密消息是JSON的base64编码，以'e'（{）或'W'（[）开头；
+            # 加密消息是msgpack的base64编码，开头字符不同，直接解密，免去一次注定失败的解码
+            if data[:1] in _PLAIN_B64_PREFIXES:
+                try:
+                    json_data = _loads(_b64decode(data))
+                    logger.debug("无需解密的消息")
+                    # 记录未加密消息的内容
+                    logger.opt(lazy=True).debug("未加密消息内容: {}", lambda: _format_for_log(json_data))
+                    
+                    # 如果有消息处理函数，调用它处理解密后的消息
+                    if self.message_handler is not None:
+                        await self.message_handler(message_data, websocket)
+                    return
+                except Exception as e:
+                    # 解码失败，说明需要解密
+                    logger.debug("需要解密的消息: {}", e)
             
             # 尝试解密消息
             try:
-                decrypted_data = decrypt(data)
-                message = json.loads(decrypted_data)
-                
-                # 记录解密后的消息内容
-                logger.info("====================【开始-解密消息日志】====================")
-                logger.info(f"解密后的消息类型: {type(message).__name__}")
-                # 限制输出长度，避免日志过大
-                message_str = json.dumps(message, ensure_ascii=False)
-                if len(message_str) > 1000:
-                    logger.info(f"解密后的消息(截取): {message_str[:1000]}...（内容过长已截断）")
+                if len(data) > _DECODE_OFFLOAD_SIZE:
+                    # 大的同步包放到解码线程池，msgpack解包和JSON解析都不占用事件循环
+                    message, has_pnm = await asyncio.get_running_loop().run_in_executor(
+                        self.decode_executor, _decrypt_message, data
+                    )
                 else:
-                    logger.info(f"解密后的消息: {message_str}")
-                logger.info("====================【结束-解密消息日志】====================")
+                    message, has_pnm = _decrypt_message(data)
+                
+                # 记录解密后的消息内容，限制输出长度，避免日志过大
+                logger.opt(lazy=True).debug(
+                    "解密后的消息({}): {}",
+                    lambda: type(message).__name__,
+                    lambda: _format_for_log(message)
+                )
             except Exception as e:
-                logger.error(f"消息解密失败: {e}")
+                logger.error("消息解密失败: {}", e)
                 return
             
             # 检查是否为订单相关消息
@@ -535,19 +615,19 @@ class XianyuWebSocket:
                 # 判断是否为订单消息
                 if '3' in message and 'redReminder' in message['3']:
                     if message['3']['redReminder'] == '等待买家付款':
-                        user_id = message['1'].split('@')[0]
+                        user_id = message['1'].partition('@')[0]
                         user_url = f'https://www.goofish.com/personal?userId={user_id}'
-                        logger.info(f'等待买家 {user_url} 付款')
+                        logger.info('等待买家 {} 付款', user_url)
                         return
                     elif message['3']['redReminder'] == '交易关闭':
-                        user_id = message['1'].split('@')[0]
+                        user_id = message['1'].partition('@')[0]
                         user_url = f'https://www.goofish.com/personal?userId={user_id}'
-                        logger.info(f'卖家 {user_url} 交易关闭')
+                        logger.info('卖家 {} 交易关闭', user_url)
                         return
                     elif message['3']['redReminder'] == '等待卖家发货':
-                        user_id = message['1'].split('@')[0]
+                        user_id = message['1'].partition('@')[0]
                         user_url = f'https://www.goofish.com/personal?userId={user_id}'
-                        logger.info(f'交易成功 {user_url} 等待卖家发货')
+                        logger.info('交易成功 {} 等待卖家发货', user_url)
                         return
             except Exception:
                 pass
@@ -558,84 +638,76 @@ class XianyuWebSocket:
                 return
             elif not self.is_chat_message(message):
                 logger.debug("其他非聊天消息")
-                logger.debug(f"原始消息: {message}")
+                logger.debug("原始消息: {}", message)
                 
                 # 尝试从非聊天消息中提取消息ID
-                non_chat_message_id = self.extract_message_id_from_non_chat(message)
+                non_chat_message_id = self.extract_message_id_from_non_chat(message) if has_pnm else None
                 if non_chat_message_id:
-                    logger.info(f"从非聊天消息中提取到消息ID: {non_chat_message_id}（不缓存）")
+                    logger.info("从非聊天消息中提取到消息ID: {}（不缓存）", non_chat_message_id)
                     
                     # 更新全局最新消息ID仅用于日志记录
                     old_latest = self.latest_message_id
                     self.latest_message_id = non_chat_message_id
-                    logger.info(f"记录全局最新消息ID: {old_latest} -> {non_chat_message_id}（仅用于日志，不用于回复）")
+                    logger.info("记录全局最新消息ID: {} -> {}（仅用于日志，不用于回复）", old_latest, non_chat_message_id)
                     
-                    # 如果是带.PNM后缀的ID，设置标志
-                    if ".PNM" in non_chat_message_id:
-                        self.found_pnm_id_flag = True
-                        logger.info("找到带PNM后缀的消息ID，设置found_pnm_id_flag=True")
+                    # 提取到的ID一定带.PNM后缀，设置标志
+                    self.found_pnm_id_flag = True
+                    logger.info("找到带PNM后缀的消息ID，设置found_pnm_id_flag=True")
                 return
             
-            # 处理聊天消息
-            create_time = int(message["1"]["5"])
-            send_user_name = message["1"]["10"]["reminderTitle"]
-            send_user_id = message["1"]["10"]["senderUserId"]
-            send_message = message["1"]["10"]["reminderContent"]
+            # 处理聊天消息，消息主体和提醒字段各取一次，后面直接复用
+            body = message["1"]
+            reminder = body["10"]
+            create_time = int(body["5"])
+            send_user_name = reminder["reminderTitle"]
+            send_user_id = reminder["senderUserId"]
+            send_message = reminder["reminderContent"]
             
             # 提取消息ID
             message_id = None
-            logger.info("====================【开始-消息ID提取日志】====================")
-            logger.info(f"尝试提取消息ID，用户: {send_user_name}，消息: {send_message}")
+            logger.debug("====================【开始-消息ID提取日志】====================")
+            logger.debug("尝试提取消息ID，用户: {}，消息: {}", send_user_name, send_message)
             
             # 记录原始消息的关键字段，方便分析
-            important_fields = {}
-            for field in ["1", "2", "3", "4", "5", "6", "10", "11", "20", "24"]:
-                if field in message and field != "1":  # 排除1字段，因为它是整个消息的主体
-                    important_fields[field] = message[field]
-                elif field in message["1"] and not isinstance(message["1"], list):
-                    important_fields[field] = message["1"][field]
-            
-            logger.info(f"消息关键字段: {json.dumps(important_fields, ensure_ascii=False)}")
+            logger.opt(lazy=True).debug("消息关键字段: {}", lambda: json.dumps(_important_fields(message), ensure_ascii=False))
             
             # 优先查找带.PNM后缀的消息ID
-            if "3" in message["1"] and isinstance(message["1"]["3"], str) and ".PNM" in message["1"]["3"]:
-                message_id = message["1"]["3"]
-                logger.info(f"优先从消息的1[3]字段提取到带PNM后缀的消息ID: {message_id}")
+            raw_message_id = body.get("3")
+            if isinstance(raw_message_id, str) and ".PNM" in raw_message_id:
+                message_id = raw_message_id
+                logger.info("优先从消息的1[3]字段提取到带PNM后缀的消息ID: {}", message_id)
                 # 设置标志，表示找到了带PNM后缀的消息ID
                 self.found_pnm_id_flag = True
                 self.latest_message_id = message_id
                 logger.info("在聊天消息中找到带PNM后缀的消息ID，设置found_pnm_id_flag=True")
             
             # 记录用户消息
-            logger.info(f"收到用户 {send_user_name}({send_user_id}) 的消息: {send_message}")
+            logger.info("收到用户 {}({}) 的消息: {}", send_user_name, send_user_id, send_message)
             
             # 获取商品信息 - 从消息字段中提取
             item_id = "unknown_item"
             item_description = "未知商品"
             
             # 尝试从扩展字段提取商品信息
-            try:
-                if "bizTag" in message["1"]["10"]:
-                    biz_tag = message["1"]["10"].get("bizTag", "")
-                    if biz_tag:
-                        try:
-                            biz_tag_json = json.loads(biz_tag)
-                            item_id = biz_tag_json.get("itemId", item_id)
-                            item_description = biz_tag_json.get("itemTitle", item_description)
-                        except Exception:
-                            pass
-            except Exception:
-                pass
+            biz_tag = reminder.get("bizTag")
+            if biz_tag:
+                try:
+                    biz_tag_json = _loads(biz_tag)
+                    item_id = biz_tag_json.get("itemId", item_id)
+                    item_description = biz_tag_json.get("itemTitle", item_description)
+                except Exception:
+                    pass
             
             # 提取会话ID
             cid = None
-            if "2" in message["1"]:
-                cid = message["1"]["2"].split('@')[0] if '@' in message["1"]["2"] else message["1"]["2"]
+            if "2" in body:
+                cid = body["2"].partition('@')[0]
             
             # 消息去重检查 - 计算消息指纹
-            import hashlib
-            import time
-            fingerprint = hashlib.md5(f"{send_user_id}:{send_message}:{item_id}".encode()).hexdigest()
+            # 指纹只用作字典键，8字节的blake2b摘要比md5十六进制字符串计算更快、占用更小
+            fingerprint = hashlib.blake2b(
+                f"{send_user_id}\x1f{send_message}\x1f{item_id}".encode(), digest_size=8
+            ).digest()
             current_time = time.time()
             
             # 检查是否为最近处理过的相同消息
@@ -643,12 +715,12 @@ class XianyuWebSocket:
                 time_diff = current_time - self.processed_messages[fingerprint]
                 window = self.processed_window if hasattr(self, 'processed_window') else 30
                 if time_diff < window:
-                    logger.warning(f"handle_message检测到短时间内({time_diff:.1f}秒)的重复消息，跳过处理: {send_message}")
+                    logger.warning("handle_message检测到短时间内({:.1f}秒)的重复消息，跳过处理: {}", time_diff, send_message)
                     return
             
             # 更新消息指纹缓存
             if hasattr(self, 'processed_messages'):
-                self.processed_messages[fingerprint] = current_time
+                self._remember_fingerprint(fingerprint, current_time)
             
             # 构建处理任务数据
             task_data = {
@@ -660,21 +732,15 @@ class XianyuWebSocket:
                 "item_description": item_description,
                 "cid": cid,
                 "message_id": message_id,
-                "fingerprint": fingerprint  # 添加指纹用于消息唯一性跟踪
+                "fingerprint": fingerprint,  # 添加指纹用于消息唯一性跟踪
+                "received_at": current_time  # 与指纹缓存中记录的时间一致，用于识别是否为同一条消息
             }
             
             # 加入消息队列处理
-            self.message_queue.put({
-                "task_data": task_data,
-                "websocket": websocket
-            })
-            
-            # 如果有消息处理函数且不是自己，调用它
-            if self.message_handler and self.message_handler != self.handle_message:
-                await self.message_handler(message_data, websocket)
+            await self._enqueue([task_data], websocket)
                 
         except Exception as e:
-            logger.error(f"消息处理总体出错: {e}")
+            logger.error("消息处理总体出错: {}", e)
             logger.exception("消息处理异常详情")
     
     async def send_heartbeat(self, ws):
@@ -685,14 +751,9 @@ class XianyuWebSocket:
             ws: WebSocket连接对象
         """
         heartbeat_mid = generate_mid()
-        heartbeat_msg = {
-            "lwp": "/!",
-            "headers": {
-                "mid": heartbeat_mid
-            }
-        }
-        await ws.send(json.dumps(heartbeat_msg))
-        self.last_heartbeat_time = time.time()
+        # 心跳包结构固定，只有mid变化，直接拼接无需序列化
+        await ws.send(self._HB_PREFIX + heartbeat_mid + self._HB_SUFFIX)
+        self.last_heartbeat_time = time.monotonic()
         logger.debug("发送心跳包")
         return heartbeat_mid
     
@@ -705,28 +766,50 @@ class XianyuWebSocket:
         """
         while True:
             try:
-                current_time = time.time()
-                
-                # 检查是否需要发送心跳
-                if current_time - self.last_heartbeat_time >= self.heartbeat_interval:
-                    await self.send_heartbeat(ws)
+                current_time = time.monotonic()
                 
                 # 检查上次心跳响应时间，如果超时则认为连接已断开
-                if (current_time - self.last_heartbeat_response) > (self.heartbeat_interval + self.heartbeat_timeout):
+                response_deadline = self.last_heartbeat_response + self.heartbeat_interval + self.heartbeat_timeout
+                if current_time > response_deadline:
                     logger.warning("心跳响应超时，可能连接已断开")
                     break
                 
-                await asyncio.sleep(1)
+                # 检查是否需要发送心跳
+                next_send = self.last_heartbeat_time + self.heartbeat_interval
+                if current_time >= next_send:
+                    await self.send_heartbeat(ws)
+                    continue
+                
+                # 直接睡眠到下一次发送心跳或判定超时的时间点，避免每秒轮询
+                await asyncio.sleep(min(next_send, response_deadline) - current_time)
             except Exception as e:
                 logger.error(f"心跳循环出错: {e}")
                 await asyncio.sleep(5)
     
-    async def handle_heartbeat_response(self, message_data):
+    @staticmethod
+    def _is_bare_ack(message) -> bool:
+        """
+        不解析JSON，判断原始帧是否为不带body的200响应
+        
+        这类帧在handle_heartbeat_response中都会被当作心跳响应处理
+        
+        Args:
+            message: 原始WebSocket帧（str或bytes）
+            
+        Returns:
+            bool: 是否为不带body的200响应
+        """
+        if isinstance(message, str):
+            return message.startswith(('{"code":200,', '{"code":200}')) and '"body"' not in message
+        return message.startswith((b'{"code":200,', b'{"code":200}')) and b'"body"' not in message
+    
+    async def handle_heartbeat_response(self, message_data, websocket=None):
         """
         处理心跳响应
         
         Args:
             message_data: 消息数据
+            websocket: WebSocket连接对象，用于回复服务端心跳推送的ACK
         
         Returns:
             bool: 是否是心跳响应
@@ -740,7 +823,7 @@ class XianyuWebSocket:
                 and "code" in message_data
                 and message_data["code"] == 200
             ):
-                self.last_heartbeat_response = time.time()
+                self.last_heartbeat_response = time.monotonic()
                 logger.debug("收到标准格式的心跳响应")
                 return True
                 
@@ -752,7 +835,7 @@ class XianyuWebSocket:
                 and message_data["code"] == 200
                 and "body" not in message_data  # 确认响应通常没有body字段
             ):
-                self.last_heartbeat_response = time.time()
+                self.last_heartbeat_response = time.monotonic()
                 logger.debug("收到简单确认格式的心跳响应")
                 return True
                 
@@ -762,9 +845,21 @@ class XianyuWebSocket:
                 and "headers" in message_data
                 and message_data.get("lwp", "") == "/!"  # 心跳请求路径
             ):
-                self.last_heartbeat_response = time.time()
+                self.last_heartbeat_response = time.monotonic()
                 logger.debug("收到心跳请求确认")
                 return True
+            
+            # 3. 服务端推送的心跳消息
+            elif isinstance(message_data, dict) and message_data.get("lwp", "").startswith("/n/r/Heartbeat"):
+                self.last_heartbeat_response = time.monotonic()
+                logger.debug("收到服务端心跳消息")
+                # 服务端推送需要ACK，与handle_message中的处理一致
+                if websocket is not None and "headers" in message_data:
+                    try:
+                        await websocket.send(_build_ack(message_data["headers"]))
+                    except Exception as e:
+                        logger.debug("发送心跳消息ACK失败: {}", e)
+                return True
                 
             # 记录不匹配任何心跳模式的消息
             logger.debug(f"不是心跳响应的消息: {message_data.get('lwp', '') if isinstance(message_data, dict) else type(message_data).__name__}")
@@ -776,7 +871,12 @@ class XianyuWebSocket:
     async def connect(self):
         """
         建立WebSocket连接并处理消息
+        
+        Returns:
+            bool: 连接是否成功建立并完成初始化，由run()据此决定重连等待时间
         """
+        established = False
+        
         # 记录token获取失败次数
         token_failure_count = 0
         max_token_failures = 3  # 最大允许的连续失败次数
@@ -786,31 +886,22 @@ class XianyuWebSocket:
         max_ws_connection_attempts = 3  # 最大WebSocket重连尝试次数
         
         try:
-            # 设置WebSocket连接的headers
-            headers = {
-                "Cookie": self.cookies_str,
-                "Host": "wss-goofish.dingtalk.com",
-                "Connection": "Upgrade",
-                "Pragma": "no-cache",
-                "Cache-Control": "no-cache",
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36",
-                "Origin": "https://www.goofish.com",
-                "Accept-Encoding": "gzip, deflate, br, zstd",
-                "Accept-Language": "zh-CN,zh;q=0.9",
-            }
+            # 设置WebSocket连接的headers，cookies可能在重新登录后更新，每次连接时读取
+            headers = {"Cookie": self.cookies_str, **self._WS_HEADERS}
             
             logger.info("正在连接到闲鱼WebSocket服务器...")
             try:
                 # 增加WebSocket连接尝试次数
                 ws_connection_attempts += 1
                 
-                async with websockets.connect(self.base_url, extra_headers=headers) as ws:
+                async with websockets.connect(self.base_url, extra_headers=headers, **self._connect_options()) as ws:
                     self.ws = ws
                     logger.info("WebSocket连接已建立")
                     
                     # 初始化连接
                     try:
                         await self.init(ws)
+                        established = True
                         # 如果成功，重置失败计数
                         token_failure_count = 0
                         ws_connection_attempts = 0  # 重置WebSocket连接尝试次数
@@ -822,23 +913,34 @@ class XianyuWebSocket:
                         raise  # 继续抛出异常，让外层处理
                     
                     # 初始化心跳时间
-                    self.last_heartbeat_time = time.time()
-                    self.last_heartbeat_response = time.time()
+                    self.last_heartbeat_time = time.monotonic()
+                    self.last_heartbeat_response = time.monotonic()
                     
                     # 启动心跳任务
                     self.heartbeat_task = asyncio.create_task(self.heartbeat_loop(ws))
                     
+                    # 读循环中每帧都要调用的方法先绑定到局部变量，省去每帧的属性查找
+                    is_bare_ack = self._is_bare_ack
+                    handle_heartbeat_response = self.handle_heartbeat_response
+                    handle_message = self.handle_message
+                    
                     # 使用与原始项目相同的消息处理循环
                     async for message in ws:
                         try:
-                            message_data = json.loads(message)
+                            # 不带body的200响应（心跳响应和ACK）占了大部分流量，无需解析JSON
+                            if is_bare_ack(message):
+                                self.last_heartbeat_response = time.monotonic()
+                                continue
                             
-                            # 处理心跳响应
-                            if await self.handle_heartbeat_response(message_data):
+                            # orjson可以直接解析str或bytes帧，无需先转换类型
+                            message_data = _loads(message)
+                            
+                            # 心跳响应和心跳推送在读循环中直接处理，不进入消息处理流程
+                            if await handle_heartbeat_response(message_data, ws):
                                 continue
                             
                             # 处理其他消息
-                            await self.handle_message(message_data, ws)
+                            await handle_message(message_data, ws)
                                 
                         except json.JSONDecodeError:
                             logger.error("消息解析失败")
@@ -869,14 +971,8 @@ class XianyuWebSocket:
                     # 强制重新获取cookies
                     force_manual_login = token_failure_count >= max_token_failures
                     await self._handle_token_failure(force_manual_login)
-                    # 等待5秒后重试
-                    await asyncio.sleep(5)
-                    return
                 else:
-                    # 等待5秒后重连
                     logger.info(f"将进行第 {ws_connection_attempts+1}/{max_ws_connection_attempts} 次WebSocket重连尝试")
-                    await asyncio.sleep(5)
-                    return
                     
         except ValueError as e:
             error_msg = str(e)
@@ -885,8 +981,6 @@ class XianyuWebSocket:
                 await self._handle_token_failure(token_failure_count >= max_token_failures)
             else:
                 logger.error(f"WebSocket连接出错: {e}")
-            # 等待5秒后重连
-            await asyncio.sleep(5)
         except Exception as e:
             logger.error(f"WebSocket连接出错: {e}")
             if self.heartbeat_task:
@@ -895,10 +989,30 @@ class XianyuWebSocket:
                     await self.heartbeat_task
                 except asyncio.CancelledError:
                     pass
-            # 等待5秒后重连
-            await asyncio.sleep(5)
         finally:
             logger.info("WebSocket连接已关闭，将尝试重新连接")
+        return established
+    
+    @staticmethod
+    def _connect_options() -> Dict:
+        """
+        WebSocket连接的压缩和缓冲区参数
+        
+        聊天消息都很短，默认关闭permessage-deflate以节省每帧的zlib开销；
+        WS_COMPRESSION=1时启用压缩，但不保留客户端压缩上下文以控制内存
+        
+        Returns:
+            Dict: 传给websockets.connect的参数
+        """
+        options = {
+            "compression": None,
+            "max_size": 2 ** 20,
+            "read_limit": 2 ** 16,
+            "write_limit": 2 ** 16,
+        }
+        if os.getenv("WS_COMPRESSION", "0") == "1":
+            options["extensions"] = [ClientPerMessageDeflateFactory(client_no_context_takeover=True)]
+        return options
     
     async def _handle_token_failure(self, force_manual_login):
         """处理token获取失败的情况"""
@@ -964,11 +1078,14 @@ class XianyuWebSocket:
         # 记录连续运行失败次数
         consecutive_failures = 0
         max_consecutive_failures = 10  # 最大连续失败次数
+        # 重连等待时间上限，连接失败时指数增长，连接成功后重置
+        backoff = _RECONNECT_BACKOFF_MIN
 
         while True:
+            established = False
             try:
                 # 尝试建立连接
-                await self.connect()
+                established = await self.connect()
                 # 如果连接成功完成并返回，则重置失败计数
                 consecutive_failures = 0
             except Exception as e:
@@ -987,9 +1104,12 @@ class XianyuWebSocket:
                     except Exception as login_error:
                         logger.critical(f"强制重新登录失败: {login_error}")
             
-            # 重连延迟
-            delay = min(30, 5 * consecutive_failures)  # 随着失败次数增加延迟时间，但最多30秒
-            logger.info(f"{delay}秒后尝试重新连接...")
+            # 重连延迟：指数退避加完全随机抖动，短暂断线快速恢复，长时间故障时避免多个实例同时重连
+            if established:
+                backoff = _RECONNECT_BACKOFF_MIN
+            delay = random.uniform(0, backoff)
+            backoff = min(_RECONNECT_BACKOFF_MAX, backoff * 2)
+            logger.info(f"{delay:.1f}秒后尝试重新连接...")
             await asyncio.sleep(delay)
 
 class XianyuLive(XianyuWebSocket):
@@ -998,27 +1118,39 @@ class XianyuLive(XianyuWebSocket):
     处理闲鱼消息并生成回复
     """
     
-    def __init__(self, cookies_str: str, bot):
+    def __init__(self, cookies_str: str, bot, queue_maxsize: int = 1024, consumer_count: int = 8):
         """
         初始化闲鱼直播对象
         
         Args:
             cookies_str (str): Cookies字符串
             bot: 回复机器人实例
+            queue_maxsize (int): 待处理消息队列的容量，队列满时接收端等待消费者处理
+            consumer_count (int): 消息消费者数量，即同时处理的队列项上限，一条消息等待模型回复时其他消费者继续处理队列
         """
         # 先创建需要的属性
         self.bot = bot
+        self._bot_has_intent = hasattr(bot, 'last_intent')  # 回复机器人是否记录意图，只在初始化时检查一次
         self.context_manager = ChatContextManager()
-        self.message_queue = Queue()
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+        # 对话历史读写是阻塞的SQLite调用，放到独立的有界线程池中执行，模型调用本身是异步的，留在事件循环上
+        self.db_executor = _shared_executor("context-db", int(os.getenv("CONTEXT_DB_WORKERS", "4")))
+        self.message_queue = asyncio.Queue(maxsize=queue_maxsize)
+        self.consumer_count = max(1, consumer_count)
+        self._last_queue_depth_log = 0.0  # 上次记录队列积压的时间，每秒最多记录一次
+        self.background_tasks = []  # 消息消费者任务，在main()中启动
         
         # 添加全局系统通知消息缓存
-        self.recent_responses = {}  # 格式: {user_id: {"message_type": str, "timestamp": float, "count": int}}
+        # 按写入时间排序，写入时顺带淘汰过期记录，无需单独的清理任务
+        self.recent_responses = OrderedDict()  # 格式: {(user_id, message_type): {"timestamp": float, "count": int, "message": str, "expires_at": float}}
         self.system_notice_window = 60  # 系统通知60秒内不重复回复
+        self.shipping_notice_ttl = 7200  # 发货相关通知的回复记录保留2小时
+        self.recent_responses_max_size = 4096  # 回复记录的最大条目数
         
         # 消息处理指纹缓存，用于检测重复消息
-        self.processed_messages = {}  # 格式: {fingerprint: timestamp}
+        # 按写入时间排序，写入时淘汰过期和超过上限的最早指纹，无需单独的清理任务
+        self.processed_messages = OrderedDict()  # 格式: {fingerprint(bytes): timestamp}
         self.processed_window = 30  # 30秒内相同指纹的消息视为重复
+        self.processed_max_size = 4096  # 指纹缓存的最大条目数
         
         # 系统通知关键词列表 - 扩展更全面的系统通知关键词
         self.system_notices = [
@@ -1040,6 +1172,12 @@ class XianyuLive(XianyuWebSocket):
             "派送", "待发货", "已打包", "发货成功"
         ]
         
+        # 两组关键词编译为一个匹配器，每条消息只需扫描一次
+        self._notice_matcher = KeywordMatcher({
+            "system": self.system_notices,
+            "shipping": self.shipping_keywords,
+        })
+        
         # 最近通知缓存，用于极短时间内的系统通知去重
         self._last_system_notification = {
             "key": "",
@@ -1053,425 +1191,359 @@ class XianyuLive(XianyuWebSocket):
         # 消息处理函数设置
         # 在父类初始化完成后，再设置消息处理函数为子类方法
         self.message_handler = self.handle_live_message
+    
+    def _remember_fingerprint(self, fingerprint, timestamp):
+        """
+        记录消息指纹的处理时间，并淘汰过期和超过缓存上限的最早记录
         
-        # 启动工作线程
-        self.worker_threads = []
-        for _ in range(3):  # 启动3个工作线程
-            worker = Thread(target=self._message_worker, args=())
-            worker.daemon = True
-            worker.start()
-            self.worker_threads.append(worker)
-            
-        # 启动定期清理系统通知缓存的线程
-        self.cache_cleaner = Thread(target=self._clean_system_notice_cache_worker, args=())
-        self.cache_cleaner.daemon = True
-        self.cache_cleaner.start()
+        Args:
+            fingerprint: 消息指纹
+            timestamp: 处理时间
+        """
+        processed = self.processed_messages
+        processed[fingerprint] = timestamp
+        processed.move_to_end(fingerprint)
+        
+        # 记录按时间先后排列，从最早的开始淘汰，使用3倍的处理窗口作为过期时间
+        expire_before = timestamp - self.processed_window * 3
+        while len(processed) > self.processed_max_size or next(iter(processed.values())) < expire_before:
+            processed.popitem(last=False)
+    
+    def _remember_response(self, user_id, message_type, info, ttl):
+        """
+        记录对系统通知的回复，并淘汰已过期和超过上限的最早记录
+        
+        Args:
+            user_id: 用户ID
+            message_type: 系统通知类型
+            info: 回复记录
+            ttl: 记录的保留时间（秒）
+        """
+        responses = self.recent_responses
+        key = (user_id, message_type)
+        info["expires_at"] = info["timestamp"] + ttl
+        responses[key] = info
+        responses.move_to_end(key)
         
-        # 启动定期清理消息指纹缓存的线程
-        self.fingerprint_cleaner = Thread(target=self._clean_message_fingerprints_worker, args=())
-        self.fingerprint_cleaner.daemon = True
-        self.fingerprint_cleaner.start()
+        # 发货通知保留时间更长，排在前面的记录未过期时后面的过期记录会晚一些淘汰，总数受上限约束
+        now = info["timestamp"]
+        while len(responses) > self.recent_responses_max_size or next(iter(responses.values()))["expires_at"] < now:
+            responses.popitem(last=False)
     
-    def _clean_system_notice_cache_worker(self):
-        """定期清理过期的系统通知缓存"""
-        import time
+    async def _run_db(self, func, *args):
+        """
+        在线程池中执行对话历史的数据库操作
         
+        Args:
+            func: ChatContextManager的方法
+            *args: 方法参数
+            
+        Returns:
+            方法的返回值
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.db_executor, func, *args)
+    
+    async def _enqueue(self, tasks, websocket):
+        """
+        将一组消息作为一个队列项加入待处理队列，队列已满时等待消费者腾出空间
+        
+        Args:
+            tasks (list): 消息任务数据列表，同一个同步包中的消息一次入队
+            websocket: WebSocket连接对象
+        """
+        if self.message_queue.full():
+            logger.warning("消息队列已满({})，等待消费者处理后再接收新消息", self.message_queue.maxsize)
+        elif not self.message_queue.empty():
+            now = time.monotonic()
+            if now - self._last_queue_depth_log >= 1:
+                self._last_queue_depth_log = now
+                logger.info("消息队列积压: {}/{}", self.message_queue.qsize(), self.message_queue.maxsize)
+        await self.message_queue.put({
+            "tasks": tasks,
+            "websocket": websocket
+        })
+    
+    async def _consume_messages(self):
+        """
+        消息队列消费者
+        每次取出一个队列项，处理完成后立即取下一项；多个消费者组成固定大小的处理池，
+        一条消息等待模型回复时不会阻塞其他消费者，也不会等待其他消息处理完成
+        """
         while True:
+            item = await self.message_queue.get()
+            tasks = item["tasks"]
+            websocket = item["websocket"]
             try:
-                # 每5分钟清理一次
-                time.sleep(300)
-                
-                # 清理过期的缓存
-                current_time = time.time()
-                users_to_clean = []
-                notices_to_clean = {}
-                
-                for user_id, notices in self.recent_responses.items():
-                    notices_to_clean[user_id] = []
-                    all_expired = True
-                    
-                    for notice_type, notice_data in notices.items():
-                        time_diff = current_time - notice_data["timestamp"]
-                        # 检查是否具有扩展窗口标记（主要用于发货相关通知）
-                        has_extended_window = notice_data.get("extended_window", False)
-                        
-                        # 根据是否有扩展窗口使用不同的过期时间
-                        expiry_time = 7200 if has_extended_window else self.system_notice_window * 2  # 扩展窗口为2小时
-                        
-                        # 如果超过系统通知窗口时间，标记为需要清理
-                        if time_diff > expiry_time:
-                            notices_to_clean[user_id].append(notice_type)
-                            logger.debug(f"标记清理: 用户 {user_id} 的 '{notice_type}' 通知已过期 {time_diff:.0f}秒 (限制: {expiry_time}秒)")
-                        else:
-                            all_expired = False
-                            if has_extended_window:
-                                logger.debug(f"保留扩展窗口通知: 用户 {user_id} 的 '{notice_type}' 通知存在 {time_diff:.0f}秒 (限制: {expiry_time}秒)")
-                    
-                    # 如果该用户的所有通知都已过期，可以清理整个用户记录
-                    if all_expired and len(notices) > 0:
-                        users_to_clean.append(user_id)
-                
-                # 执行清理
-                for user_id in users_to_clean:
-                    if user_id in self.recent_responses:
-                        del self.recent_responses[user_id]
-                        logger.debug(f"清理用户 {user_id} 的所有系统通知缓存")
-                
-                for user_id, notices in notices_to_clean.items():
-                    if user_id in self.recent_responses:
-                        for notice_type in notices:
-                            if notice_type in self.recent_responses[user_id]:
-                                del self.recent_responses[user_id][notice_type]
-                                logger.debug(f"清理用户 {user_id} 的 '{notice_type}' 系统通知缓存")
-                
-                # 日志记录清理状态
-                if users_to_clean or any(notices for notices in notices_to_clean.values()):
-                    logger.info(f"系统通知缓存清理完成: 清理了 {len(users_to_clean)} 个用户记录")
+                if len(tasks) == 1:
+                    await self._process_message(tasks[0], websocket)
+                else:
+                    # 同一个同步包中的多条消息同时到达，并发处理
+                    await asyncio.gather(
+                        *(self._process_message(task_data, websocket) for task_data in tasks),
+                        return_exceptions=True
+                    )
             except Exception as e:
-                logger.error(f"清理系统通知缓存时出错: {e}")
-                # 异常后等待30秒再继续
-                time.sleep(30)
+                logger.error("消息消费者处理出错: {}", e)
+            finally:
+                self.message_queue.task_done()
     
-    def _message_worker(self):
+    async def _process_message(self, task_data, websocket):
         """
-        消息处理工作线程函数
-        从队列中获取消息并处理
+        处理队列中的一条消息，处理期间的日志自动附带用户和商品
+        
+        Args:
+            task_data (dict): 消息任务数据
+            websocket: WebSocket连接对象
         """
-        while True:
-            task_completed = False  # 添加标记，避免重复调用task_done()
-            try:
-                # 从队列中获取消息
-                message_data = self.message_queue.get()
-                if message_data is None:  # 结束信号
-                    self.message_queue.task_done()
-                    break
-                    
-                task_data = message_data["task_data"]
-                websocket = message_data["websocket"]
-                
-                # 解构任务数据
-                message = task_data["message"]
-                send_user_name = task_data["send_user_name"]
-                send_user_id = task_data["send_user_id"]
-                send_message = task_data["send_message"]
-                item_id = task_data["item_id"]
-                item_description = task_data["item_description"]
-                cid = task_data["cid"]
-                message_id = task_data.get("message_id")  # 获取消息ID，用于引用回复
-                fingerprint = task_data.get("fingerprint", "")  # 获取消息指纹
-                
-                # 再次检查消息指纹，确保没有其他线程已经处理过相同的消息
-                # 这是双重保险，防止短时间内相同消息通过不同渠道进入队列
-                if fingerprint:
-                    import time
-                    current_time = time.time()
-                    last_processed_time = self.processed_messages.get(fingerprint, 0)
-                    
-                    # 只有当指纹匹配且时间差在窗口内时才认为是重复
-                    time_diff = current_time - last_processed_time
-                    if (last_processed_time > 0 and 
-                        time_diff < self.processed_window and
-                        time_diff > 0.001):  # 添加最小时间差阈值，防止误判
-                        logger.warning(f"工作线程检测到短时间内({time_diff:.2f}秒)的重复消息，跳过处理: {send_message}")
-                        # 标记任务为完成 - 只有当消息确实是重复时才标记
-                        self.message_queue.task_done()
-                        task_completed = True
-                        continue
-                    
-                    # 更新处理时间戳，表示正在处理该消息
-                    if not fingerprint in self.processed_messages or time_diff > self.processed_window:
-                        # 只有新消息或超过窗口的旧消息才更新时间戳
-                        self.processed_messages[fingerprint] = current_time
-                
-                logger.info(f"处理用户 {send_user_name} 的消息: {send_message}")
-                
-                # 消息分析日志 - 仅对可能的系统通知进行详细日志
-                if send_message in ["发来一条新消息", "新消息", "系统通知"] or any(notice in send_message for notice in self.system_notices):
-                    logger.info("----------- 系统通知分析开始 -----------")
-                    
-                    # 提取关键字段
-                    if isinstance(message, dict) and "1" in message and isinstance(message["1"], dict):
-                        # 尝试提取消息各关键部分
-                        if "10" in message["1"] and isinstance(message["1"]["10"], dict):
-                            biz_tag = message["1"]["10"].get("bizTag", "")
-                            ext_json = message["1"]["10"].get("extJson", "")
-                            reminder_title = message["1"]["10"].get("reminderTitle", "")
-                            reminder_content = message["1"]["10"].get("reminderContent", "")
-                            reminder_url = message["1"]["10"].get("reminderUrl", "")
-                            
-                            logger.info(f"系统通知标题: {reminder_title}")
-                            logger.info(f"系统通知内容: {reminder_content}")
-                            logger.info(f"系统通知URL: {reminder_url}")
-                            
-                            # 尝试解析业务标签
-                            if biz_tag:
-                                try:
-                                    biz_tag_obj = json.loads(biz_tag)
-                                    task_name = biz_tag_obj.get("taskName", "")
-                                    task_id = biz_tag_obj.get("taskId", "")
-                                    logger.info(f"系统通知任务名称: {task_name}")
-                                    logger.info(f"系统通知任务ID: {task_id}")
-                                except Exception as e:
-                                    logger.warning(f"解析bizTag失败: {e}")
-                            
-                            # 尝试解析扩展JSON
-                            if ext_json:
-                                try:
-                                    ext_json_obj = json.loads(ext_json)
-                                    msg_args = ext_json_obj.get("msgArgs", {})
-                                    logger.info(f"系统通知参数: {msg_args}")
-                                except Exception as e:
-                                    logger.warning(f"解析extJson失败: {e}")
-                    
-                    logger.info("----------- 系统通知分析结束 -----------")
-                
-                # 检查系统通知的标志
-                is_system_notice = False
-                is_shipping_notice = False
-                
-                # 更详细的系统通知检查 - 消息内容匹配
-                if any(notice in send_message for notice in self.system_notices):
-                    is_system_notice = True
-                    logger.info(f"检测到系统通知: '{send_message}'")
-                
-                # 检查消息中是否存在关键字段，这是系统通知的另一种特征
-                if isinstance(message, dict) and "1" in message and isinstance(message["1"], dict):
-                    if "10" in message["1"] and isinstance(message["1"]["10"], dict):
-                        # 检查reminderContent字段
-                        if "reminderContent" in message["1"]["10"] and message["1"]["10"]["reminderContent"] == "发来一条新消息":
-                            is_system_notice = True
-                            logger.info(f"从消息字段检测到系统通知: reminderContent='发来一条新消息'")
-                        
-                        # 检查消息类型是否为发货相关
-                        if "extJson" in message["1"]["10"]:
-                            try:
-                                ext_json = json.loads(message["1"]["10"]["extJson"])
-                                if "task_id" in ext_json.get("msgArgs", {}):
-                                    # 记录任务ID，可能包含重要信息
-                                    task_id = ext_json["msgArgs"]["task_id"]
-                                    logger.info(f"系统通知任务ID: {task_id}")
-                                    
-                                    # 通过任务ID识别消息类型
-                                    if "taskName" in message["1"]["10"].get("bizTag", ""):
-                                        try:
-                                            biz_tag = json.loads(message["1"]["10"]["bizTag"])
-                                            task_name = biz_tag.get("taskName", "")
-                                            if task_name:
-                                                logger.info(f"系统通知任务名称: {task_name}")
-                                                if any(keyword in task_name for keyword in ["发货", "付款", "订单", "退款"]):
-                                                    is_system_notice = True
-                                                    
-                                                    # 特别标记发货相关通知
-                                                    if "发货" in task_name:
-                                                        is_shipping_notice = True
-                                                        logger.info(f"检测到发货相关系统通知: {task_name}")
-                                        except Exception:
-                                            pass
-                            except Exception:
-                                pass
+        # contextualize基于contextvars，并发处理的消息各自在独立的任务中，互不影响
+        with logger.contextualize(user=task_data.get("send_user_name", "-"), item=task_data.get("item_id", "-")):
+            await self._reply_to_message(task_data, websocket)
+    
+    async def _reply_to_message(self, task_data, websocket):
+        """
+        回复一条消息：系统通知识别、去重、生成回复并发送
+        
+        Args:
+            task_data (dict): 消息任务数据
+            websocket: WebSocket连接对象
+        """
+        try:
+            # 解构任务数据
+            message = task_data["message"]
+            send_user_name = task_data["send_user_name"]
+            send_user_id = task_data["send_user_id"]
+            send_message = task_data["send_message"]
+            item_id = task_data["item_id"]
+            item_description = task_data["item_description"]
+            cid = task_data["cid"]
+            message_id = task_data.get("message_id")  # 获取带.PNM后缀的消息ID，用于引用回复，没有时为None
+            fingerprint = task_data.get("fingerprint", b"")  # 获取消息指纹
+            received_at = task_data.get("received_at")  # 入队时记录的指纹时间
+            
+            # 再次检查消息指纹，确保同一批次中没有其他任务已经处理过相同的消息
+            # 这是双重保险，防止短时间内相同消息通过不同渠道进入队列
+            if fingerprint:
+                current_time = time.time()
+                last_processed_time = self.processed_messages.get(fingerprint, 0)
                 
-                # 临时收集所有可能与发货相关的关键词
-                shipping_keywords = self.shipping_keywords
-                if any(keyword in send_message for keyword in shipping_keywords):
-                    is_shipping_notice = True
-                    is_system_notice = True
-                    logger.info(f"检测到包含发货关键词的消息: '{send_message}'")
+                # 只有当指纹匹配、时间差在窗口内且记录的不是本条消息时才认为是重复
+                # 消息在队列中等待的时间不固定，不能用时间差判断是否为同一条消息
+                time_diff = current_time - last_processed_time
+                if (last_processed_time > 0 and 
+                    last_processed_time != received_at and
+                    time_diff < self.processed_window):
+                    logger.warning("消费者检测到短时间内({:.2f}秒)的重复消息，跳过处理: {}", time_diff, send_message)
+                    return
                 
-                # 额外检查：消息是否为"发来一条新消息"
-                if send_message == "发来一条新消息":
-                    # 这是一个典型的系统通知而非用户消息
+                # 更新处理时间戳，表示正在处理该消息
+                if not fingerprint in self.processed_messages or time_diff > self.processed_window:
+                    # 只有新消息或超过窗口的旧消息才更新时间戳
+                    self._remember_fingerprint(fingerprint, current_time)
+            
+            logger.info("处理消息: {}", send_message)
+            
+            # 一次扫描得到命中的系统通知关键词（按列表顺序取第一个）和是否包含发货关键词
+            keyword_hits = self._notice_matcher.match(send_message)
+            system_notice_keyword = keyword_hits.get("system")
+            
+            # 提醒字段只取一次，其中的bizTag和extJson各解析一次，分析日志和系统通知判断共用
+            reminder = None
+            if isinstance(message, dict) and isinstance(message.get("1"), dict):
+                reminder = message["1"].get("10")
+                if not isinstance(reminder, dict):
+                    reminder = None
+            biz_tag = reminder.get("bizTag", "") if reminder is not None else ""
+            ext_json = reminder.get("extJson", "") if reminder is not None else ""
+            # bizTag只有在按任务名称判断通知类型时才需要，分析日志需要时再解析
+            biz_tag_obj = _json_object(biz_tag) if "taskName" in biz_tag else None
+            ext_json_obj = _json_object(ext_json)
+            
+            # 消息分析日志 - 仅对可能的系统通知记录一行汇总，日志级别高于INFO时不提取字段也不解析
+            if reminder is not None and (send_message in _NOTICE_MESSAGES or system_notice_keyword is not None):
+                logger.opt(lazy=True).info(
+                    "系统通知分析: {}",
+                    lambda: _describe_notice(
+                        reminder,
+                        biz_tag_obj if biz_tag_obj is not None else _json_object(biz_tag),
+                        ext_json_obj,
+                    )
+                )
+            
+            # 检查系统通知的标志
+            is_system_notice = False
+            is_shipping_notice = False
+            
+            # 更详细的系统通知检查 - 消息内容匹配
+            if system_notice_keyword is not None:
+                is_system_notice = True
+                logger.info("检测到系统通知: '{}'", send_message)
+            
+            # 检查消息中是否存在关键字段，这是系统通知的另一种特征
+            if reminder is not None:
+                # 检查reminderContent字段
+                if reminder.get("reminderContent") == "发来一条新消息":
                     is_system_notice = True
-                    logger.info("检测到系统标准通知: '发来一条新消息'")
-                    
-                    # 检查消息中的其他线索判断是否为发货相关
-                    if isinstance(message, dict) and "1" in message and isinstance(message["1"], dict):
-                        if "10" in message["1"] and isinstance(message["1"]["10"], dict):
-                            reminder_url = message["1"]["10"].get("reminderUrl", "")
-                            if "order_detail" in reminder_url:
-                                is_shipping_notice = True
-                                logger.info("通过URL检测到订单/发货相关通知")
+                    logger.info("从消息字段检测到系统通知: reminderContent='发来一条新消息'")
                 
-                # 额外的系统通知去重检查
-                if is_system_notice:
-                    import time
-                    current_time = time.time()
-                    
-                    # 确定消息类型 - 对于系统通知，我们根据其内容分类
-                    message_type = None
-                    for notice in self.system_notices:
-                        if notice in send_message:
-                            message_type = notice
-                            break
-                    
-                    if not message_type:
-                        if is_shipping_notice:
-                            message_type = "发货通知"
-                        else:
-                            message_type = "系统通知"  # 默认类型
+                # 检查消息类型是否为发货相关
+                msg_args = ext_json_obj.get("msgArgs") if ext_json_obj is not None else None
+                if isinstance(msg_args, dict) and "task_id" in msg_args:
+                    # 记录任务ID，可能包含重要信息
+                    logger.info("系统通知任务ID: {}", msg_args["task_id"])
                     
-                    # 对于"发来一条新消息"特殊处理，用item_id和user_id组合作为更精确的标识
-                    if send_message == "发来一条新消息":
-                        unique_key = f"{send_user_id}_{message_type}" 
-                        
-                        # 检查全局缓存是否最近有同类型的系统通知
-                        if hasattr(self, '_last_system_notification'):
-                            last_notif = getattr(self, '_last_system_notification')
-                            if last_notif.get('key') == unique_key:
-                                time_diff = current_time - last_notif.get('time', 0)
-                                if time_diff < 10:  # 特别短的去重窗口(10秒)用于系统通知
-                                    logger.warning(f"极短时间内({time_diff:.1f}秒)收到相同系统通知，忽略此消息: {send_message}")
-                                    self.message_queue.task_done()
-                                    task_completed = True
-                                    continue
-                        
-                        # 更新最近系统通知记录
-                        if not hasattr(self, '_last_system_notification'):
-                            setattr(self, '_last_system_notification', {})
-                        getattr(self, '_last_system_notification').update({
-                            'key': unique_key,
-                            'time': current_time,
-                            'message': send_message
-                        })
-                    
-                    # 检查是否在去重窗口内已经回复过此类型的消息
-                    if send_user_id in self.recent_responses:
-                        user_responses = self.recent_responses[send_user_id]
-                        
-                        # 如果该用户最近收到过此类型系统通知的回复
-                        if message_type in user_responses:
-                            response_info = user_responses[message_type]
-                            time_diff = current_time - response_info["timestamp"]
+                    # 通过任务名称识别消息类型
+                    task_name = biz_tag_obj.get("taskName", "") if biz_tag_obj is not None else ""
+                    if task_name and isinstance(task_name, str):
+                        logger.info("系统通知任务名称: {}", task_name)
+                        if any(keyword in task_name for keyword in ["发货", "付款", "订单", "退款"]):
+                            is_system_notice = True
                             
-                            # 如果在系统通知去重窗口内且已经回复过相同类型的消息
-                            if time_diff < self.system_notice_window:
-                                # 记录被过滤的消息
-                                logger.info(f"系统通知去重: 已在 {time_diff:.2f} 秒内对用户 {send_user_name} 回复过类似的 '{message_type}' 通知，跳过此消息")
-                                # 递增计数
-                                self.recent_responses[send_user_id][message_type]["count"] += 1
-                                # 跳过本次消息处理
-                                self.message_queue.task_done()
-                                task_completed = True
-                                continue
-                    
-                    # 如果不存在用户记录，创建一个新的
-                    if send_user_id not in self.recent_responses:
-                        self.recent_responses[send_user_id] = {}
-                
-                # 添加用户消息到上下文
-                self.context_manager.add_message(send_user_id, item_id, "user", send_message)
-                
-                # 获取完整的对话上下文
-                context = self.context_manager.get_context(send_user_id, item_id)
-                
-                # 对发货相关通知或系统通知使用固定回复
-                if is_shipping_notice:
-                    # 直接使用预设回复
-                    bot_reply = "已为您发货，请注意查收物流信息。如有问题随时联系我哟~"
-                    logger.info(f"发货通知: 使用固定回复: {bot_reply}")
-                elif is_system_notice:
-                    # 对一般系统通知使用简短统一回复
-                    bot_reply = "收到通知，感谢您的支持！如有问题随时联系我哟~"
-                    logger.info(f"系统通知: 使用统一回复: {bot_reply}")
-                else:
-                    # 对普通消息使用模型生成回复
-                    bot_reply = self.bot.generate_reply(
-                        send_message,
-                        item_description,
-                        context=context
-                    )
+                            # 特别标记发货相关通知
+                            if "发货" in task_name:
+                                is_shipping_notice = True
+                                logger.info("检测到发货相关系统通知: {}", task_name)
+            
+            # 检查是否包含发货相关的关键词
+            if "shipping" in keyword_hits:
+                is_shipping_notice = True
+                is_system_notice = True
+                logger.info("检测到包含发货关键词的消息: '{}'", send_message)
+            
+            # 额外检查：消息是否为"发来一条新消息"
+            if send_message == "发来一条新消息":
+                # 这是一个典型的系统通知而非用户消息
+                is_system_notice = True
+                logger.info("检测到系统标准通知: '发来一条新消息'")
                 
-                # 检查是否为价格意图
-                if hasattr(self.bot, 'last_intent') and self.bot.last_intent == "price":
-                    self.context_manager.increment_bargain_count(send_user_id, item_id)
-                    bargain_count = self.context_manager.get_bargain_count(send_user_id, item_id)
-                    logger.info(f"用户 {send_user_name} 对商品 {item_id} 的议价次数: {bargain_count}")
+                # 检查消息中的其他线索判断是否为发货相关
+                if reminder is not None and "order_detail" in reminder.get("reminderUrl", ""):
+                    is_shipping_notice = True
+                    logger.info("通过URL检测到订单/发货相关通知")
+            
+            # 额外的系统通知去重检查
+            if is_system_notice:
+                current_time = time.time()
                 
-                # 添加机器人回复到上下文
-                self.context_manager.add_message(send_user_id, item_id, "assistant", bot_reply)
+                # 确定消息类型 - 对于系统通知，我们根据其内容分类
+                message_type = system_notice_keyword
                 
-                logger.info(f"机器人回复 {send_user_name}: {bot_reply}")
+                if not message_type:
+                    if is_shipping_notice:
+                        message_type = "发货通知"
+                    else:
+                        message_type = "系统通知"  # 默认类型
                 
-                # 如果是系统通知，更新最近回复记录
-                if is_system_notice:
-                    import time
-                    current_time = time.time()
-                    message_type = None
-                    for notice in self.system_notices:
-                        if notice in send_message:
-                            message_type = notice
-                            break
-                    
-                    if not message_type:
-                        if is_shipping_notice:
-                            message_type = "发货通知"
-                        else:
-                            message_type = "系统通知"
+                # 对于"发来一条新消息"特殊处理，用item_id和user_id组合作为更精确的标识
+                if send_message == "发来一条新消息":
+                    unique_key = f"{send_user_id}_{message_type}" 
                     
-                    # 更新回复记录
-                    self.recent_responses[send_user_id][message_type] = {
-                        "timestamp": current_time,
-                        "count": 1,
-                        "message": send_message[:50]  # 保存消息前50个字符用于日志
-                    }
+                    # 检查全局缓存是否最近有同类型的系统通知
+                    last_notif = self._last_system_notification
+                    if last_notif.get('key') == unique_key:
+                        time_diff = current_time - last_notif.get('time', 0)
+                        if time_diff < 10:  # 特别短的去重窗口(10秒)用于系统通知
+                            logger.warning("极短时间内({:.1f}秒)收到相同系统通知，忽略此消息: {}", time_diff, send_message)
+                            return
                     
-                    # 为发货相关消息设置更长的去重窗口
-                    if is_shipping_notice:
-                        logger.info("设置发货相关通知的去重窗口为2小时")
-                        # 将发货相关消息的去重窗口设为两小时
-                        self.recent_responses[send_user_id][message_type]["extended_window"] = True
-                
-                # 消息ID处理 - 优先从消息中提取带.PNM后缀的消息ID
-                reply_to_message_id = None
+                    # 更新最近系统通知记录
+                    last_notif.update({
+                        'key': unique_key,
+                        'time': current_time,
+                        'message': send_message
+                    })
                 
-                # 检查是否之前有找到过带PNM后缀的消息ID
-                if not self.found_pnm_id_flag:
-                    logger.warning("当前会话中尚未找到过带PNM后缀的消息ID，引用回复可能无法正常工作")
+                # 检查是否在去重窗口内已经回复过此用户此类型的消息
+                response_info = self.recent_responses.get((send_user_id, message_type))
+                if response_info is not None:
+                    time_diff = current_time - response_info["timestamp"]
                     
-                # 直接从消息原始字段中尝试提取带.PNM后缀的消息ID
-                if isinstance(message, dict) and "1" in message and isinstance(message["1"], dict):
-                    # 尝试从message["1"]["3"]字段获取带PNM后缀的ID
-                    if "3" in message["1"] and isinstance(message["1"]["3"], str) and ".PNM" in message["1"]["3"]:
-                        reply_to_message_id = message["1"]["3"]
-                        logger.info(f"从消息字段1[3]提取到带PNM后缀的消息ID: {reply_to_message_id}")
-                
-                # 如果从原始字段没有找到带PNM后缀的ID，尝试使用全局最新消息ID
-                if not reply_to_message_id and self.latest_message_id:
-                    if ".PNM" in self.latest_message_id:
-                        reply_to_message_id = self.latest_message_id
-                        logger.info(f"使用全局最新带PNM后缀的消息ID: {reply_to_message_id}")
-                    else:
-                        logger.warning(f"全局最新消息ID {self.latest_message_id} 无PNM后缀，不适合用于引用")
+                    # 如果在系统通知去重窗口内且已经回复过相同类型的消息
+                    if time_diff < self.system_notice_window:
+                        # 记录被过滤的消息
+                        logger.info("系统通知去重: 已在 {:.2f} 秒内对用户 {} 回复过类似的 '{}' 通知，跳过此消息", time_diff, send_user_name, message_type)
+                        # 递增计数
+                        response_info["count"] += 1
+                        # 跳过本次消息处理
+                        return
+            
+            # 添加用户消息到上下文并获取完整的对话上下文，一次数据库操作完成
+            context = await self._run_db(self.context_manager.begin_turn, send_user_id, item_id, send_message)
+            
+            # 对发货相关通知或系统通知使用固定回复
+            if is_shipping_notice:
+                # 直接使用预设回复
+                bot_reply = "已为您发货，请注意查收物流信息。如有问题随时联系我哟~"
+                logger.info("发货通知: 使用固定回复: {}", bot_reply)
+            elif is_system_notice:
+                # 对一般系统通知使用简短统一回复
+                bot_reply = "收到通知，感谢您的支持！如有问题随时联系我哟~"
+                logger.info("系统通知: 使用统一回复: {}", bot_reply)
+            else:
+                # 对普通消息使用模型生成回复
+                bot_reply = await self.bot.generate_reply(
+                    send_message,
+                    item_description,
+                    context=context
+                )
+            
+            # 检查是否为价格意图，与添加机器人回复到上下文在一次数据库操作中完成
+            is_price = self._bot_has_intent and self.bot.last_intent == "price"
+            bargain_count = await self._run_db(self.context_manager.end_turn, send_user_id, item_id, bot_reply, is_price)
+            if is_price:
+                logger.info("议价次数: {}", bargain_count)
+            
+            logger.info("机器人回复: {}", bot_reply)
+            
+            # 如果是系统通知，更新最近回复记录
+            if is_system_notice:
+                current_time = time.time()
+                message_type = system_notice_keyword
                 
-                # 如果还是找不到带PNM后缀的ID，则使用传入的message_id
-                if not reply_to_message_id and message_id:
-                    if ".PNM" in message_id:
-                        reply_to_message_id = message_id
-                        logger.info(f"使用传入的带PNM后缀消息ID: {reply_to_message_id}")
+                if not message_type:
+                    if is_shipping_notice:
+                        message_type = "发货通知"
                     else:
-                        logger.warning(f"传入的消息ID {message_id} 无PNM后缀，可能不适合用于引用")
+                        message_type = "系统通知"
                 
-                # 日志记录
-                if reply_to_message_id:
-                    logger.info(f"将使用消息ID: {reply_to_message_id} 进行引用回复")
+                # 为发货相关消息保留更长时间的回复记录
+                if is_shipping_notice:
+                    logger.info("设置发货相关通知的去重窗口为2小时")
+                    ttl = self.shipping_notice_ttl
                 else:
-                    logger.warning("无有效的带PNM后缀消息ID，将发送普通消息（不使用引用回复）")
-                
-                # 使用事件循环发送消息，如果有消息ID则使用引用回复
-                asyncio.run(XianyuLive.send_msg_static(
-                    websocket, 
-                    cid, 
-                    send_user_id, 
-                    bot_reply, 
-                    self.cookies,
-                    reply_to_message_id=reply_to_message_id
-                ))
+                    ttl = self.system_notice_window * 2
                 
-            except Exception as e:
-                logger.error(f"处理队列消息时发生错误: {str(e)}")
-            finally:
-                # 标记任务完成 - 只有当之前没有标记过时才调用
-                if not task_completed:
-                    self.message_queue.task_done()
+                # 更新回复记录
+                self._remember_response(send_user_id, message_type, {
+                    "timestamp": current_time,
+                    "count": 1,
+                    "message": send_message[:50]  # 保存消息前50个字符用于日志
+                }, ttl)
+            
+            # 检查是否之前有找到过带PNM后缀的消息ID
+            if not self.found_pnm_id_flag:
+                logger.warning("当前会话中尚未找到过带PNM后缀的消息ID，引用回复可能无法正常工作")
+            
+            # 消息ID处理 - 入队时只记录带.PNM后缀的ID，全局最新消息ID也只保存带.PNM后缀的ID，无需再次检查
+            reply_to_message_id = message_id or self.latest_message_id
+            
+            # 日志记录
+            if reply_to_message_id:
+                logger.info("将使用消息ID: {} 进行引用回复", reply_to_message_id)
+            else:
+                logger.warning("无有效的带PNM后缀消息ID，将发送普通消息（不使用引用回复）")
+            
+            # 发送消息，如果有消息ID则使用引用回复
+            await XianyuLive.send_msg_static(
+                websocket, 
+                cid, 
+                send_user_id, 
+                bot_reply, 
+                self.cookies,
+                reply_to_message_id=reply_to_message_id
+            )
+            
+        except Exception as e:
+            logger.error("处理队列消息时发生错误: {}", e)
     
     async def handle_live_message(self, message_data, websocket):
         """
@@ -1482,131 +1554,107 @@ class XianyuLive(XianyuWebSocket):
             websocket: WebSocket连接对象
         """
         # 日志记录
-        logger.debug(f"XianyuLive处理消息: {message_data.get('lwp', '')}")
+        logger.opt(lazy=True).debug("XianyuLive处理消息: {}", lambda: message_data.get('lwp', ''))
         
-        # 尝试从同步包中提取消息ID
+        # 只处理同步包，心跳消息在读循环中已由handle_heartbeat_response处理
         if self.is_sync_package(message_data):
-            try:
-                logger.info("处理同步包消息")
-                body = message_data.get("body", {})
-                sync_package = body.get("syncPushPackage", {})
-                sync_data = sync_package.get("data", [])
-                
-                if sync_data and len(sync_data) > 0:
-                    # 尝试解析msgSync消息
-                    msgs = sync_data[0].get("msgs", [])
-                    if msgs:
-                        logger.info(f"发现同步包中的msgs字段，包含 {len(msgs)} 条消息")
-                        
-                    for msg in msgs:
-                        # 提取消息ID
-                        msg_id = msg.get("uuid", "")
-                        if msg_id and ".PNM" in msg_id:
-                            self.latest_message_id = msg_id
-                            self.found_pnm_id_flag = True
-                            logger.info(f"从同步包中提取到带PNM后缀的消息ID: {msg_id}")
-                            
-                        # 处理消息内容
-                        # 解密消息内容
-                        content = msg.get("content", {})
-                        if content and content.get("contentType") == 101:
-                            custom_data = content.get("custom", {})
-                            if custom_data:
-                                try:
-                                    decoded_data = base64.b64decode(custom_data.get("data", ""))
-                                    decoded_content = json.loads(decoded_data)
-                                    
-                                    # 只处理文本消息
-                                    if decoded_content.get("contentType") == 1:
-                                        # 提取消息文本
-                                        message_text = decoded_content.get("text", {}).get("text", "")
-                                        
-                                        # 获取发送者信息
-                                        from_id = msg.get("fromId", "").split("@")[0]
-                                        
-                                        # 忽略自己发送的消息
-                                        if from_id == self.myid:
-                                            continue
-                                        
-                                        # 获取会话和商品信息
-                                        cid = msg.get("cid", "").split("@")[0]
-                                        
-                                        # 尝试从扩展字段获取用户名和商品信息
-                                        extension = msg.get("extension", {})
-                                        ext_json_str = extension.get("extJson", "{}")
-                                        
-                                        try:
-                                            ext_json = json.loads(ext_json_str) if ext_json_str else {}
-                                        except Exception:
-                                            ext_json = {}
-                                        
-                                        # 提取发送者名称和商品信息
-                                        send_user_name = ext_json.get("senderName", "未知用户")
-                                        item_id = ext_json.get("itemId", "")
-                                        item_description = ext_json.get("itemDescription", "未知商品")
-                                        
-                                        # 如果消息不为空，处理消息
-                                        if message_text:
-                                            logger.info(f"收到用户 {send_user_name}({from_id}) 的消息: {message_text}")
-                                            
-                                            # 构建任务数据
-                                            task_data = {
-                                                "message": msg,  # 原始消息
-                                                "send_user_name": send_user_name,
-                                                "send_user_id": from_id,
-                                                "send_message": message_text,
-                                                "item_id": item_id,
-                                                "item_description": item_description,
-                                                "cid": cid,
-                                                "message_id": msg_id if ".PNM" in msg_id else None
-                                            }
-                                            
-                                            # 加入消息队列
-                                            self.message_queue.put({
-                                                "task_data": task_data,
-                                                "websocket": websocket
-                                            })
-                                except Exception as e:
-                                    logger.error(f"解析消息内容时出错: {str(e)}")
-            except Exception as e:
-                logger.error(f"处理同步包消息时出错: {str(e)}")
-                
-        # 处理心跳响应
-        elif "lwp" in message_data and message_data["lwp"].startswith("/n/r/Heartbeat"):
-            try:
-                await self.handle_heartbeat_response(message_data)
-            except Exception as e:
-                logger.error(f"处理心跳响应出错: {str(e)}")
+            await self._handle_sync_package(message_data, websocket)
     
-    async def main(self):
-        """启动闲鱼直播连接主函数"""
-        await self.run() 
-
-    def _clean_message_fingerprints_worker(self):
-        """定期清理过期的消息指纹缓存"""
-        import time
+    async def _handle_sync_package(self, message_data, websocket):
+        """
+        处理同步包：提取消息ID，解码其中的文本消息并加入队列
         
-        while True:
-            try:
-                # 每2分钟清理一次
-                time.sleep(120)
-                
-                # 清理过期的缓存
-                current_time = time.time()
-                expired_fingerprints = []
-                
-                for fingerprint, timestamp in self.processed_messages.items():
-                    if current_time - timestamp > self.processed_window * 3:  # 使用3倍的处理窗口作为过期时间
-                        expired_fingerprints.append(fingerprint)
-                
-                # 删除过期的指纹
-                for fingerprint in expired_fingerprints:
-                    del self.processed_messages[fingerprint]
+        Args:
+            message_data (dict): 消息数据
+            websocket: WebSocket连接对象
+        """
+        try:
+            logger.info("处理同步包消息")
+            # is_sync_package已确认data列表非空，直接取第一项
+            msgs = message_data["body"]["syncPushPackage"]["data"][0].get("msgs") or ()
+            if msgs:
+                logger.info("发现同步包中的msgs字段，包含 {} 条消息", len(msgs))
                 
-                if expired_fingerprints:
-                    logger.debug(f"已清理 {len(expired_fingerprints)} 个过期消息指纹，当前缓存大小: {len(self.processed_messages)}")
+            # 同一个同步包中的消息汇总后一次入队
+            tasks = []
+            for msg in msgs:
+                # 提取消息ID
+                msg_id = msg.get("uuid") or ""
+                has_pnm = ".PNM" in msg_id
+                if has_pnm:
+                    self.latest_message_id = msg_id
+                    self.found_pnm_id_flag = True
+                    logger.info("从同步包中提取到带PNM后缀的消息ID: {}", msg_id)
                     
-            except Exception as e:
-                logger.error(f"清理消息指纹缓存时出错: {e}")
-                # 异常后等待30秒再继续
-                time.sleep(30) 
\ No newline at end of file
+                # 处理消息内容，只有自定义消息(101)需要解码
+                content = msg.get("content") or _EMPTY
+                if content.get("contentType") != 101:
+                    continue
+                # 没有内容数据的消息（已读回执、系统事件等）不进入解码
+                custom_data = (content.get("custom") or _EMPTY).get("data")
+                if not custom_data:
+                    continue
+                try:
+                    decoded_content = _loads(_b64decode(custom_data))
+                    
+                    # 只处理文本消息
+                    if decoded_content.get("contentType") != 1:
+                        continue
+                    # 提取消息文本
+                    message_text = (decoded_content.get("text") or _EMPTY).get("text") or ""
+                    
+                    # 获取发送者信息，忽略自己发送的消息
+                    from_id = (msg.get("fromId") or "").partition("@")[0]
+                    if from_id == self.myid:
+                        continue
+                    
+                    # 如果消息为空，不处理
+                    if not message_text:
+                        continue
+                    
+                    # 获取会话信息
+                    cid = (msg.get("cid") or "").partition("@")[0]
+                    
+                    # 尝试从扩展字段获取用户名和商品信息
+                    ext_json_str = (msg.get("extension") or _EMPTY).get("extJson")
+                    try:
+                        ext_json = _loads(ext_json_str) if ext_json_str else _EMPTY
+                    except Exception:
+                        ext_json = _EMPTY
+                    
+                    # 提取发送者名称和商品信息
+                    send_user_name = ext_json.get("senderName", "未知用户")
+                    item_id = ext_json.get("itemId", "")
+                    item_description = ext_json.get("itemDescription", "未知商品")
+                    
+                    logger.info("收到用户 {}({}) 的消息: {}", send_user_name, from_id, message_text)
+                    
+                    # 构建任务数据
+                    task_data = {
+                        "message": msg,  # 原始消息
+                        "send_user_name": send_user_name,
+                        "send_user_id": from_id,
+                        "send_message": message_text,
+                        "item_id": item_id,
+                        "item_description": item_description,
+                        "cid": cid,
+                        "message_id": msg_id if has_pnm else None
+                    }
+                    
+                    tasks.append(task_data)
+                except Exception as e:
+                    logger.error("解析消息内容时出错: {}", e)
+            
+            # 加入消息队列
+            if tasks:
+                await self._enqueue(tasks, websocket)
+        except Exception as e:
+            logger.error("处理同步包消息时出错: {}", e)
+    
+    async def main(self):
+        """启动闲鱼直播连接主函数"""
+        # 启动消息消费者，与WebSocket连接共用同一个事件循环；去重缓存在写入时淘汰过期记录，无需清理任务
+        self.background_tasks = [
+            asyncio.create_task(self._consume_messages()) for _ in range(self.consumer_count)
+        ]
+        await self.run()
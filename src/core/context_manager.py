@@ -102,30 +102,7 @@ class ChatContextManager:
         cursor = conn.cursor()
         
         try:
-            # 插入新消息
-            cursor.execute(
-                "INSERT INTO messages (user_id, item_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
-                (user_id, item_id, role, content, datetime.now().isoformat())
-            )
-            
-            # 检查是否需要清理旧消息
-            cursor.execute(
-                """
-                SELECT id FROM messages 
-                WHERE user_id = ? AND item_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT ?, 1
-                """, 
-                (user_id, item_id, self.max_history)
-            )
-            
-            oldest_to_keep = cursor.fetchone()
-            if oldest_to_keep:
-                cursor.execute(
-                    "DELETE FROM messages WHERE user_id = ? AND item_id = ? AND id < ?",
-                    (user_id, item_id, oldest_to_keep[0])
-                )
-            
+            self._insert_message(cursor, user_id, item_id, role, content)
             conn.commit()
             logger.debug(f"已添加用户 {user_id} 商品 {item_id} 的{role}消息")
         except Exception as e:
@@ -134,34 +111,29 @@ class ChatContextManager:
         finally:
             conn.close()
         
-    def increment_bargain_count(self, user_id: str, item_id: str) -> None:
+    def increment_bargain_count(self, user_id: str, item_id: str) -> int:
         """
         增加用户对特定商品的议价次数
         
         Args:
             user_id: 用户ID
             item_id: 商品ID
+            
+        Returns:
+            int: 增加后的议价次数，出错时返回0
         """
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
         try:
-            # 使用UPSERT语法（SQLite 3.24.0及以上版本支持）
-            cursor.execute(
-                """
-                INSERT INTO bargain_counts (user_id, item_id, count, last_updated)
-                VALUES (?, ?, 1, ?)
-                ON CONFLICT(user_id, item_id) 
-                DO UPDATE SET count = count + 1, last_updated = ?
-                """,
-                (user_id, item_id, datetime.now().isoformat(), datetime.now().isoformat())
-            )
-            
+            count = self._increment_bargain(cursor, user_id, item_id)
             conn.commit()
             logger.debug(f"用户 {user_id} 商品 {item_id} 议价次数已增加")
+            return count
         except Exception as e:
             logger.error(f"增加议价次数时出错: {e}")
             conn.rollback()
+            return 0
         finally:
             conn.close()
     
@@ -180,13 +152,7 @@ class ChatContextManager:
         cursor = conn.cursor()
         
         try:
-            cursor.execute(
-                "SELECT count FROM bargain_counts WHERE user_id = ? AND item_id = ?",
-                (user_id, item_id)
-            )
-            
-            result = cursor.fetchone()
-            return result[0] if result else 0
+            return self._read_bargain_count(cursor, user_id, item_id)
         except Exception as e:
             logger.error(f"获取议价次数时出错: {e}")
             return 0
@@ -208,27 +174,7 @@ class ChatContextManager:
         cursor = conn.cursor()
         
         try:
-            cursor.execute(
-                """
-                SELECT role, content FROM messages 
-                WHERE user_id = ? AND item_id = ? 
-                ORDER BY timestamp ASC
-                LIMIT ?
-                """, 
-                (user_id, item_id, self.max_history)
-            )
-            
-            messages = [{"role": role, "content": content} for role, content in cursor.fetchall()]
-            
-            # 获取议价次数并添加到上下文中
-            bargain_count = self.get_bargain_count(user_id, item_id)
-            if bargain_count > 0:
-                # 添加一条系统消息，包含议价次数信息
-                messages.append({
-                    "role": "system", 
-                    "content": f"议价次数: {bargain_count}"
-                })
-            
+            messages = self._read_context(cursor, user_id, item_id)
             logger.debug(f"已获取用户 {user_id} 商品 {item_id} 的对话历史，共 {len(messages)} 条消息")
             return messages
         except Exception as e:
@@ -237,6 +183,135 @@ class ChatContextManager:
         finally:
             conn.close()
     
+    def begin_turn(self, user_id: str, item_id: str, content: str) -> List[Dict[str, str]]:
+        """
+        开始一轮对话：记录用户消息并返回包含该消息的对话历史，在同一个连接和事务中完成
+        
+        Args:
+            user_id: 用户ID
+            item_id: 商品ID
+            content: 用户消息内容
+            
+        Returns:
+            list: 包含对话历史的列表，出错时返回空列表
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        try:
+            self._insert_message(cursor, user_id, item_id, "user", content)
+            messages = self._read_context(cursor, user_id, item_id)
+            conn.commit()
+            return messages
+        except Exception as e:
+            logger.error(f"记录用户消息并获取对话历史时出错: {e}")
+            conn.rollback()
+            return []
+        finally:
+            conn.close()
+    
+    def end_turn(self, user_id: str, item_id: str, reply: str, bump_bargain: bool = False) -> int:
+        """
+        结束一轮对话：按需增加议价次数并记录回复，在同一个连接和事务中完成
+        
+        Args:
+            user_id: 用户ID
+            item_id: 商品ID
+            reply: 回复内容
+            bump_bargain: 是否增加议价次数
+            
+        Returns:
+            int: 增加后的议价次数，未增加或出错时返回0
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        try:
+            count = self._increment_bargain(cursor, user_id, item_id) if bump_bargain else 0
+            self._insert_message(cursor, user_id, item_id, "assistant", reply)
+            conn.commit()
+            return count
+        except Exception as e:
+            logger.error(f"记录回复时出错: {e}")
+            conn.rollback()
+            return 0
+        finally:
+            conn.close()
+    
+    def _insert_message(self, cursor: sqlite3.Cursor, user_id: str, item_id: str, role: str, content: str) -> None:
+        """插入一条消息，并清理超过max_history的旧消息"""
+        cursor.execute(
+            "INSERT INTO messages (user_id, item_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+            (user_id, item_id, role, content, datetime.now().isoformat())
+        )
+        
+        # 检查是否需要清理旧消息
+        cursor.execute(
+            """
+            SELECT id FROM messages 
+            WHERE user_id = ? AND item_id = ? 
+            ORDER BY timestamp DESC 
+            LIMIT ?, 1
+            """, 
+            (user_id, item_id, self.max_history)
+        )
+        
+        oldest_to_keep = cursor.fetchone()
+        if oldest_to_keep:
+            cursor.execute(
+                "DELETE FROM messages WHERE user_id = ? AND item_id = ? AND id < ?",
+                (user_id, item_id, oldest_to_keep[0])
+            )
+    
+    def _read_context(self, cursor: sqlite3.Cursor, user_id: str, item_id: str) -> List[Dict[str, str]]:
+        """读取对话历史，议价次数大于0时追加一条系统消息"""
+        cursor.execute(
+            """
+            SELECT role, content FROM messages 
+            WHERE user_id = ? AND item_id = ? 
+            ORDER BY timestamp ASC
+            LIMIT ?
+            """, 
+            (user_id, item_id, self.max_history)
+        )
+        
+        messages = [{"role": role, "content": content} for role, content in cursor.fetchall()]
+        
+        # 获取议价次数并添加到上下文中
+        bargain_count = self._read_bargain_count(cursor, user_id, item_id)
+        if bargain_count > 0:
+            # 添加一条系统消息，包含议价次数信息
+            messages.append({
+                "role": "system", 
+                "content": f"议价次数: {bargain_count}"
+            })
+        return messages
+    
+    @staticmethod
+    def _read_bargain_count(cursor: sqlite3.Cursor, user_id: str, item_id: str) -> int:
+        """读取议价次数"""
+        cursor.execute(
+            "SELECT count FROM bargain_counts WHERE user_id = ? AND item_id = ?",
+            (user_id, item_id)
+        )
+        result = cursor.fetchone()
+        return result[0] if result else 0
+    
+    def _increment_bargain(self, cursor: sqlite3.Cursor, user_id: str, item_id: str) -> int:
+        """议价次数加一，返回增加后的次数"""
+        # 使用UPSERT语法（SQLite 3.24.0及以上版本支持）
+        now = datetime.now().isoformat()
+        cursor.execute(
+            """
+            INSERT INTO bargain_counts (user_id, item_id, count, last_updated)
+            VALUES (?, ?, 1, ?)
+            ON CONFLICT(user_id, item_id) 
+            DO UPDATE SET count = count + 1, last_updated = ?
+            """,
+            (user_id, item_id, now, now)
+        )
+        return self._read_bargain_count(cursor, user_id, item_id)
+    
     def get_user_items(self, user_id: str) -> List[str]:
         """
         获取用户交互过的所有商品ID
@@ -455,4 +530,5 @@ class ChatContextManager:
             if conn:
                 conn.close()
             if backup_conn:
-                backup_conn.close() 
\ No newline at end of file
+                backup_conn.close() 
+
@@ -0,0 +1,398 @@
+"""
+回复缓存模块
+缓存大模型生成的回复，相同的提问在有效期内直接复用，减少重复的模型调用
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 语义缓存依赖numpy，未安装时只能使用精确缓存
+SEMANTIC_CACHE_AVAILABLE = np is not None
+
+# 语义缓存在数据库中的保留时间（秒）
+_SEMANTIC_RETENTION = 24 * 3600
+# 过期记录的清理间隔（秒）
+_PRUNE_INTERVAL = 600
+# 同一个数据库连接可能被多个线程使用，写入时加锁
+_db_lock = threading.Lock()
+# 数据库读写放到单独的线程中按提交顺序执行，不阻塞事件循环
+_db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response-cache-db")
+
+
+def open_cache_db(db_path: str) -> Optional[sqlite3.Connection]:
+    """
+    打开回复缓存数据库，多个进程或重启后可以共享已缓存的回复
+    
+    Args:
+        db_path: SQLite数据库文件路径
+        
+    Returns:
+        Optional[sqlite3.Connection]: 数据库连接，打开失败时返回None（仅使用内存缓存）
+    """
+    try:
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        db.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS resp (k BLOB PRIMARY KEY, ns TEXT, ts REAL, reply TEXT);
+            CREATE TABLE IF NOT EXISTS sem (bucket TEXT, ns TEXT, ts REAL, emb BLOB, prompt TEXT, reply TEXT);
+            CREATE INDEX IF NOT EXISTS idx_sem_ns ON sem (ns, ts);
+            CREATE INDEX IF NOT EXISTS idx_resp_ts ON resp (ts);
+            CREATE INDEX IF NOT EXISTS idx_sem_ts ON sem (ts);
+        """)
+        return db
+    except Exception as e:
+        logger.error(f"打开回复缓存数据库失败，仅使用内存缓存: {e}")
+        return None
+
+
+class ResponseCache:
+    """
+    回复缓存
+
+    以商品描述、用户消息、议价次数和最近对话内容生成缓存键，
+    不同用户提出完全相同的问题时可以直接复用已生成的回复。
+    使用OrderedDict实现LRU淘汰，并为每条记录设置过期时间。
+    提供数据库连接时，内存未命中再查询数据库，写入同时落库。
+    构造函数不访问数据库，在事件循环中应通过create创建，启动时的清理在数据库线程中执行。
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = 600,
+                 db: Optional[sqlite3.Connection] = None, namespace: str = ""):
+        """
+        初始化回复缓存
+
+        Args:
+            max_size: 缓存的最大条目数
+            ttl: 缓存条目的有效期（秒）
+            db: 用于持久化的数据库连接，为None时只使用内存
+            namespace: 缓存命名空间（如提示词版本），不同命名空间的记录互不复用
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db = db
+        self.namespace = namespace
+        self._cache: "OrderedDict[bytes, Tuple[float, str]]" = OrderedDict()
+        self._last_prune = 0.0
+
+    @classmethod
+    async def create(cls, **kwargs) -> "ResponseCache":
+        """
+        创建回复缓存，并在数据库线程中清理过期记录
+
+        Args:
+            **kwargs: 与构造函数相同的参数
+
+        Returns:
+            ResponseCache: 回复缓存
+        """
+        cache = cls(**kwargs)
+        if cache.db is not None:
+            # 只清理过期记录，其他命名空间（如其他提示词版本的进程）的记录保留，查询时按命名空间过滤
+            await asyncio.get_running_loop().run_in_executor(_db_executor, cache._prune, time.time())
+        return cache
+
+    @staticmethod
+    def make_key(item_desc: str, user_msg: str, bargain_count: int, context: str) -> bytes:
+        """
+        生成缓存键
+
+        Args:
+            item_desc: 商品描述
+            user_msg: 用户消息
+            bargain_count: 议价次数
+            context: 对话上下文，只取最后512个字符
+
+        Returns:
+            bytes: 16字节的缓存键
+        """
+        raw = f"{item_desc}\x1f{user_msg}\x1f{bargain_count}\x1f{context[-512:]}"
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).digest()
+
+    async def get(self, key: bytes) -> Optional[str]:
+        """
+        读取缓存的回复，内存未命中时在数据库线程中查询
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[str]: 缓存的回复，未命中或已过期时返回None
+        """
+        entry = self._cache.get(key)
+        if entry is None:
+            if self.db is None:
+                return None
+            entry = await asyncio.get_running_loop().run_in_executor(_db_executor, self._load, key)
+            if entry is None:
+                return None
+            self._cache[key] = entry
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+        created_at, reply = entry
+        if time.time() - created_at > self.ttl:
+            del self._cache[key]
+            return None
+
+        self._cache.move_to_end(key)
+        logger.debug("回复缓存命中")
+        return reply
+
+    def put(self, key: bytes, reply: str) -> None:
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            reply: 大模型生成的回复
+        """
+        created_at = time.time()
+        self._cache[key] = (created_at, reply)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+        if self.db is not None:
+            # 落库交给数据库线程，不等待写入完成
+            _db_executor.submit(self._store, key, created_at, reply)
+
+    def _store(self, key: bytes, created_at: float, reply: str) -> None:
+        """
+        将缓存记录写入数据库，并定期清理过期记录，在数据库线程中执行
+
+        Args:
+            key: 缓存键
+            created_at: 创建时间
+            reply: 回复
+        """
+        try:
+            with _db_lock:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO resp (k, ns, ts, reply) VALUES (?, ?, ?, ?)",
+                    (key, self.namespace, created_at, reply)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"写入回复缓存数据库失败: {e}")
+        if created_at - self._last_prune >= _PRUNE_INTERVAL:
+            self._prune(created_at)
+
+    def _prune(self, now: float) -> None:
+        """
+        删除数据库中已过期的缓存记录
+
+        Args:
+            now: 当前时间
+        """
+        self._last_prune = now
+        try:
+            with _db_lock:
+                self.db.execute("DELETE FROM resp WHERE ts < ?", (now - self.ttl,))
+        except sqlite3.Error as e:
+            logger.error(f"清理回复缓存数据库失败: {e}")
+
+    def _load(self, key: bytes) -> Optional[Tuple[float, str]]:
+        """
+        从数据库读取缓存记录
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[Tuple[float, str]]: (创建时间, 回复)，不存在时返回None
+        """
+        if self.db is None:
+            return None
+        try:
+            with _db_lock:
+                row = self.db.execute(
+                    "SELECT ts, reply FROM resp WHERE k = ? AND ns = ?", (key, self.namespace)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"读取回复缓存数据库失败: {e}")
+            return None
+        return tuple(row) if row else None
+
+
+class SemanticCache:
+    """
+    语义缓存
+
+    按商品分桶保存用户提问的向量和对应回复，新的提问与历史提问的余弦相似度
+    超过阈值时直接复用历史回复，用于命中“能便宜点吗”“可以少点吗”这类换个说法的重复问题。
+    每个桶为固定容量的先进先出队列。
+    提供数据库连接时，启动时加载最近的记录，新增记录同时落库。
+    构造函数不访问数据库，在事件循环中应通过create创建，加载记录在数据库线程中执行。
+    """
+
+    def __init__(self, threshold: float = 0.92, max_per_item: int = 256,
+                 db: Optional[sqlite3.Connection] = None, namespace: str = ""):
+        """
+        初始化语义缓存
+
+        Args:
+            threshold: 复用回复所需的最小余弦相似度
+            max_per_item: 每个商品最多保存的提问数量
+            db: 用于持久化的数据库连接，为None时只使用内存
+            namespace: 缓存命名空间（如提示词版本），不同命名空间的记录互不复用
+        """
+        self.threshold = threshold
+        self.max_per_item = max_per_item
+        self.db = db
+        self.namespace = namespace
+        # 格式: {bucket: (向量矩阵N×D, 提问列表, 回复列表)}
+        self._buckets: Dict[str, Tuple["np.ndarray", List[str], List[str]]] = {}
+        self._last_prune = 0.0
+
+    @classmethod
+    async def create(cls, **kwargs) -> "SemanticCache":
+        """
+        创建语义缓存，并在数据库线程中加载当前命名空间的记录
+
+        Args:
+            **kwargs: 与构造函数相同的参数
+
+        Returns:
+            SemanticCache: 语义缓存
+        """
+        cache = cls(**kwargs)
+        if cache.db is not None and SEMANTIC_CACHE_AVAILABLE:
+            await asyncio.get_running_loop().run_in_executor(_db_executor, cache._restore)
+        return cache
+
+    @staticmethod
+    def normalize(vector) -> Optional["np.ndarray"]:
+        """
+        将向量转换为L2归一化的float32数组
+
+        Args:
+            vector: 向量（列表或数组）
+
+        Returns:
+            Optional[np.ndarray]: 归一化后的向量，零向量返回None
+        """
+        arr = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(arr)
+        if norm == 0:
+            return None
+        return arr / norm
+
+    def lookup(self, bucket: str, embedding: "np.ndarray") -> Optional[str]:
+        """
+        查找语义相近的历史回复
+
+        Args:
+            bucket: 分桶键
+            embedding: 已归一化的提问向量
+
+        Returns:
+            Optional[str]: 相似度最高且超过阈值的回复，否则返回None
+        """
+        entry = self._buckets.get(bucket)
+        if entry is None:
+            return None
+
+        matrix, prompts, replies = entry
+        sims = matrix @ embedding
+        best = int(sims.argmax())
+        if sims[best] < self.threshold:
+            return None
+
+        logger.info("语义缓存命中: 相似度 {:.3f}，相似提问: {}", float(sims[best]), prompts[best])
+        return replies[best]
+
+    def _restore(self) -> None:
+        """清理数据库中的过期记录，并加载当前命名空间的记录"""
+        self._prune(time.time())
+        try:
+            with _db_lock:
+                rows = self.db.execute(
+                    "SELECT bucket, emb, prompt, reply FROM sem WHERE ns = ? ORDER BY ts", (self.namespace,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"加载语义缓存失败: {e}")
+            return
+
+        for bucket, emb, prompt, reply in rows:
+            self._append(bucket, np.frombuffer(emb, dtype=np.float32), prompt, reply)
+        if rows:
+            logger.info(f"已从数据库加载 {len(rows)} 条语义缓存")
+
+    def add(self, bucket: str, embedding: "np.ndarray", prompt: str, reply: str) -> None:
+        """
+        记录提问和回复
+
+        Args:
+            bucket: 分桶键
+            embedding: 已归一化的提问向量
+            prompt: 用户提问
+            reply: 大模型生成的回复
+        """
+        self._append(bucket, embedding, prompt, reply)
+
+        if self.db is not None:
+            # 落库交给数据库线程，不等待写入完成
+            _db_executor.submit(
+                self._store, bucket, time.time(), embedding.astype(np.float32).tobytes(), prompt, reply
+            )
+
+    def _store(self, bucket: str, created_at: float, emb: bytes, prompt: str, reply: str) -> None:
+        """将一条记录写入数据库，并定期清理过期记录，在数据库线程中执行"""
+        try:
+            with _db_lock:
+                self.db.execute(
+                    "INSERT INTO sem (bucket, ns, ts, emb, prompt, reply) VALUES (?, ?, ?, ?, ?, ?)",
+                    (bucket, self.namespace, created_at, emb, prompt, reply)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"写入语义缓存数据库失败: {e}")
+        if created_at - self._last_prune >= _PRUNE_INTERVAL:
+            self._prune(created_at)
+
+    def _prune(self, now: float) -> None:
+        """删除数据库中超过保留时间的记录"""
+        self._last_prune = now
+        try:
+            with _db_lock:
+                self.db.execute("DELETE FROM sem WHERE ts < ?", (now - _SEMANTIC_RETENTION,))
+        except sqlite3.Error as e:
+            logger.error(f"清理语义缓存数据库失败: {e}")
+
+    def _append(self, bucket: str, embedding: "np.ndarray", prompt: str, reply: str) -> None:
+        """将一条记录加入内存中的分桶"""
+        entry = self._buckets.get(bucket)
+        if entry is None:
+            self._buckets[bucket] = (embedding[np.newaxis, :], [prompt], [reply])
+            return
+
+        matrix, prompts, replies = entry
+        if matrix.shape[1] != embedding.shape[0]:
+            # 向量维度变化（例如更换了向量模型），丢弃旧数据
+            self._buckets[bucket] = (embedding[np.newaxis, :], [prompt], [reply])
+            return
+
+        matrix = np.vstack((matrix, embedding))
+        prompts.append(prompt)
+        replies.append(reply)
+        if len(prompts) > self.max_per_item:
+            overflow = len(prompts) - self.max_per_item
+            matrix = matrix[overflow:]
+            del prompts[:overflow]
+            del replies[:overflow]
+        self._buckets[bucket] = (matrix, prompts, replies)
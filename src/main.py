@@ -2,6 +2,7 @@ import asyncio
 import os
 import platform
 import argparse
+import sys
 from loguru import logger
 from dotenv import load_dotenv
 
@@ -13,6 +14,41 @@ from utils.xianyu_utils import get_login_cookies, load_cookies, trans_cookies, c
 # 检测操作系统类型
 IS_WINDOWS = platform.system() == 'Windows'
 
+
+def setup_event_loop_policy():
+    """根据平台设置事件循环策略，需要在asyncio.run之前调用"""
+    if IS_WINDOWS:
+        # Windows平台使用SelectorEventLoop避免ProactorEventLoop的问题
+        # 解决Windows上常见的"Event loop is closed"错误
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        logger.info("Windows平台: 设置了WindowsSelectorEventLoopPolicy")
+        return
+    
+    # 其他平台优先使用uvloop，提升WebSocket收发的吞吐量
+    try:
+        import uvloop
+    except ImportError:
+        logger.info("未安装uvloop，使用默认事件循环")
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    logger.info("已启用uvloop事件循环")
+
+def _log_format(record):
+    """日志格式，在消息处理过程中附带logger.contextualize绑定的用户和商品"""
+    context = " | {extra[user]}/{extra[item]}" if "user" in record["extra"] else ""
+    return (
+        "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+        "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan>"
+        + context + " - <level>{message}</level>\n{exception}"
+    )
+
+
+def setup_logging():
+    """按LOG_LEVEL配置日志输出，需要在加载环境变量之后调用"""
+    logger.remove()
+    logger.add(sys.stderr, level=os.getenv("LOG_LEVEL", "INFO").upper(), format=_log_format)
+
+
 async def main():
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='闲鱼机器人')
@@ -21,6 +57,7 @@ async def main():
     
     # 加载环境变量
     load_dotenv()
+    setup_logging()
     
     # 如果指定了强制登录选项，则打开浏览器获取登录凭证
     if args.login:
@@ -56,20 +93,20 @@ async def main():
     bot = XianyuReplyBot()
     
     # 初始化websocket连接
-    xianyu_live = XianyuLive(cookies_str, bot)
+    xianyu_live = XianyuLive(
+        cookies_str, bot,
+        queue_maxsize=int(os.getenv("MESSAGE_QUEUE_SIZE", "256")),
+        consumer_count=int(os.getenv("MESSAGE_CONSUMERS", "8")),
+    )
     
     # 启动主循环
     await xianyu_live.main()
 
 if __name__ == "__main__":
     try:
-        # 在Windows上设置默认事件循环策略，解决asyncio兼容性问题
-        if IS_WINDOWS:
-            # Windows平台使用SelectorEventLoop避免ProactorEventLoop的问题
-            # 解决Windows上常见的"Event loop is closed"错误
-            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-            logger.info("Windows平台: 设置了WindowsSelectorEventLoopPolicy")
-            
+        # 设置事件循环策略：Windows解决asyncio兼容性问题，其他平台使用uvloop
+        setup_event_loop_policy()
+        
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("程序被用户中断")
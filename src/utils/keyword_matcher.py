@@ -0,0 +1,84 @@
+"""
+关键词匹配模块
+将多组关键词编译为一个Aho-Corasick自动机，一次扫描文本即可得到每组命中的关键词
+"""
+
+from typing import Dict, Iterable, Mapping
+
+try:
+    # pyahocorasick为C扩展，扫描时间只与文本长度有关，与关键词数量无关
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+class KeywordMatcher:
+    """
+    多组关键词匹配器
+
+    每组关键词按列表顺序确定优先级，同一组内命中多个关键词时返回排在最前面的一个，
+    与按顺序逐个判断 keyword in text 的结果一致。
+    文本恰好等于某个关键词时直接查表返回预先计算的结果，无需扫描。
+    未安装pyahocorasick时退化为逐个子串判断。
+    """
+
+    def __init__(self, groups: Mapping[str, Iterable[str]]):
+        """
+        初始化关键词匹配器
+
+        Args:
+            groups: 关键词分组，格式: {组名: 关键词列表}
+        """
+        self.groups = {name: tuple(keywords) for name, keywords in groups.items()}
+        self._automaton = None
+
+        if ahocorasick is not None and any(self.groups.values()):
+            automaton = ahocorasick.Automaton()
+            for name, keywords in self.groups.items():
+                for priority, keyword in enumerate(keywords):
+                    # 同一个关键词可能出现在多个组中，值中保存所有所属的组
+                    entries = automaton.get(keyword, ())
+                    automaton.add_word(keyword, entries + ((name, priority, keyword),))
+            automaton.make_automaton()
+            self._automaton = automaton
+
+        # 系统通知等消息经常与关键词完全相同，预先计算每个关键词自身的匹配结果
+        self._exact: Dict[str, Dict[str, str]] = {}
+        for keywords in self.groups.values():
+            for keyword in keywords:
+                if keyword not in self._exact:
+                    self._exact[keyword] = self._scan(keyword)
+
+    def match(self, text: str) -> Dict[str, str]:
+        """
+        查找文本中每组优先级最高的关键词
+
+        Args:
+            text: 待匹配的文本
+
+        Returns:
+            Dict[str, str]: 格式: {组名: 命中的关键词}，未命中的组不出现在结果中
+        """
+        hits = self._exact.get(text)
+        if hits is not None:
+            return dict(hits)
+        return self._scan(text)
+
+    def _scan(self, text: str) -> Dict[str, str]:
+        """扫描文本，查找每组优先级最高的关键词"""
+        if self._automaton is None:
+            hits = {}
+            for name, keywords in self.groups.items():
+                for keyword in keywords:
+                    if keyword in text:
+                        hits[name] = keyword
+                        break
+            return hits
+
+        best = {}
+        for _, entries in self._automaton.iter(text):
+            for name, priority, keyword in entries:
+                current = best.get(name)
+                if current is None or priority < current[0]:
+                    best[name] = (priority, keyword)
+        return {name: keyword for name, (_, keyword) in best.items()}
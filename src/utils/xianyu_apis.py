@@ -3,11 +3,16 @@
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import time
 from loguru import logger
 from utils.xianyu_utils import generate_device_id, generate_sign
 
+# 获取令牌接口使用的appKey
+_APP_KEY = "444e9908a51d1cb236a27862abc769c9"
+
 
 class XianyuApis:
     """闲鱼API类，提供与闲鱼API交互的功能"""
@@ -31,6 +36,23 @@ class XianyuApis:
             'sec-fetch-site': 'same-site',
             'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36',
         }
+        
+        # 复用连接池，避免每次请求都重新建立TCP+TLS连接
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=8,
+            pool_maxsize=32,
+            # mtop接口均为带签名的POST请求，不可重复提交，只在请求未发出的连接失败时重试
+            max_retries=Retry(
+                total=2,
+                connect=2,
+                read=0,
+                status=0,
+                backoff_factor=0.3
+            )
+        )
+        self.session.mount("https://", adapter)
     
     def get_token(self, cookies, device_id):
         """
@@ -70,7 +92,7 @@ class XianyuApis:
                 'spm_cnt': 'a21ybx.im.0.0',
             }
             
-            data_val = '{"appKey":"444e9908a51d1cb236a27862abc769c9","deviceId":"' + device_id + '"}'
+            data_val = json.dumps({"appKey": _APP_KEY, "deviceId": device_id}, separators=(",", ":"))
             data = {
                 'data': data_val,
             }
@@ -87,7 +109,7 @@ class XianyuApis:
             logger.info(f"正在请求闲鱼API获取token，使用设备ID: {device_id}")
             logger.debug(f"请求URL参数: {params}")
             
-            response = requests.post(self.url, params=params, cookies=cookies, headers=self.headers, data=data)
+            response = self.session.post(self.url, params=params, cookies=cookies, data=data, timeout=(3, 10))
             
             # 检查响应状态
             if response.status_code != 200:
@@ -193,7 +215,7 @@ class XianyuApis:
             }
             
             # 发送请求
-            response = requests.post(url, headers=headers, params=params, json=data)
+            response = self.session.post(url, headers=headers, params=params, json=data, timeout=(3, 10))
             
             # 检查响应状态
             if response.status_code != 200:
@@ -3,8 +3,12 @@
 提供生成签名、处理cookies等通用工具函数
 """
 
+import hashlib
 import json
+import random
 import subprocess
+import time
+import uuid
 from functools import partial
 import os
 import sys
@@ -15,6 +19,18 @@ from playwright.async_api import async_playwright
 import re
 import shutil
 
+try:
+    # pybase64使用SIMD指令加速，接口与标准库一致
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+try:
+    from msgpack import unpackb
+except ImportError:
+    unpackb = None
+    logger.error("缺少 'msgpack' 库，无法进行 msgpack 解码。请尝试运行 'pip install msgpack' 安装。")
+
 # 检测操作系统类型
 IS_WINDOWS = platform.system() == 'Windows'
 
@@ -44,21 +60,14 @@ else:
 # 纯Python实现的函数
 def _py_generate_mid():
     """生成消息ID的纯Python实现"""
-    import random
-    import time
     return f"{int(1000 * random.random())}{int(time.time() * 1000)} 0"
 
 def _py_generate_uuid():
     """生成UUID的纯Python实现"""
-    import time
     return f"-{int(time.time() * 1000)}1"
 
 def _py_generate_device_id(user_id):
     """生成设备ID的纯Python实现"""
-    import random
-    import time
-    import uuid
-    
     # 尝试使用uuid模块生成一个基于用户ID的确定性UUID
     try:
         device_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, f"xianyubot-{user_id}"))
@@ -91,7 +100,6 @@ def _py_generate_sign(t, token, data):
     Returns:
         str: MD5签名
     """
-    import hashlib
     msg = f"{token}&{t}&34839810&{data}"
     return hashlib.md5(msg.encode('utf-8')).hexdigest()
 
@@ -416,18 +424,6 @@ def _py_decrypt(data):
         str: 解密后的JSON字符串
     """
     try:
-        import base64
-        import json
-        import struct
-
-        # 尝试导入 msgpack
-        msgpack_available = False
-        try:
-            from msgpack import unpackb
-            msgpack_available = True
-        except ImportError:
-            logger.error("缺少 'msgpack' 库，无法进行 msgpack 解码。请尝试运行 'pip install msgpack' 安装。")
-
         # 首先尝试标准base64解码
         try:
             decoded = base64.b64decode(data)
@@ -439,7 +435,7 @@ def _py_decrypt(data):
             logger.debug(f"标准base64+UTF-8解码尝试失败: {e}")
 
         # 如果 msgpack 可用，尝试使用 msgpack 解包
-        if msgpack_available:
+        if unpackb is not None:
             try:
                 # 确保 decoded 变量存在 (来自上面的 try block)
                 if 'decoded' not in locals():